@@ -1,7 +1,35 @@
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 from utils.exceptions import ProcessingError
 
+class PreparedDocument:
+    """Разбитый на фрагменты документ с эмбеддингами фрагментов"""
+    SEPARATOR = "\n\n"
+    TOP_K = 5
+
+    def __init__(self, chunks: List[str], embeddings: Any):
+        self.chunks = chunks
+        self.embeddings = embeddings
+
+    @classmethod
+    def build(cls, text: str, embedding_model) -> "PreparedDocument":
+        chunks = text.split(cls.SEPARATOR)
+        return cls(chunks, embedding_model.encode(chunks))
+
+    @classmethod
+    def version(cls, embedding_model_name: str) -> str:
+        """Модель эмбеддингов и параметры нарезки и отбора фрагментов"""
+        return f"{embedding_model_name}:{cls.SEPARATOR!r}:{cls.TOP_K}"
+
+    def relevant_sections(self, query: str, embedding_model, top_k: Optional[int] = None) -> str:
+        from sentence_transformers import util
+
+        top_k = top_k or self.TOP_K
+        query_embedding = embedding_model.encode(query)
+        scores = util.pytorch_cos_sim(query_embedding, self.embeddings)[0]
+        top_indices = scores.argsort(descending=True)[:top_k]
+        return "\n".join([self.chunks[i] for i in top_indices])
+
 class Agent(ABC):
     def __init__(self, config: Dict[str, Any] = None):
         self.config = config or {}
@@ -20,8 +48,21 @@ class Agent(ABC):
         """Список обязательных параметров конфигурации"""
         return []
 
+    @property
+    def version(self) -> str:
+        """Версия результата execute для ключей мемоизации стадий"""
+        return self.__class__.__name__
+
+    async def prepare(self, input_data: str) -> Any:
+        """Подготовка без побочных эффектов (загрузка, парсинг, эмбеддинги).
+
+        Может запускаться спекулятивно до завершения санитайзинга и
+        отменяться, поэтому не должна обращаться к LLM или песочнице.
+        """
+        return None
+
     @abstractmethod
-    async def execute(self, input_data: str) -> str:
+    async def execute(self, input_data: str, prepared: Optional[Any] = None) -> str:
         """Основной метод выполнения задачи"""
         pass
 
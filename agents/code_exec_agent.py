@@ -1,9 +1,10 @@
 import re
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from .base import Agent
 from utils.docker_sandbox import DockerSandbox
 from utils.exceptions import (CodeExecutionError, ResourceLimitExceeded,
                          DockerSecurityException)
+from utils.metrics import metrics
 
 class CodeExecutionAgent(Agent):
     MAX_OUTPUT_LENGTH = 10000
@@ -28,11 +29,21 @@ class CodeExecutionAgent(Agent):
         super().__init__(config)
         self.sandbox = DockerSandbox(config["docker_config"])
         
-    async def execute(self, input_data: str) -> str:
-        """Безопасное выполнение кода"""
+    async def prepare(self, input_data: str) -> bool:
+        """Статическая проверка кода; песочница не запускается"""
         try:
             self._validate_code(input_data)
-            result = await self.sandbox.execute(input_data)
+        except DockerSecurityException as e:
+            raise CodeExecutionError(f"Security violation: {str(e)}") from e
+        return True
+
+    async def execute(self, input_data: str, prepared: Optional[Any] = None) -> str:
+        """Безопасное выполнение кода"""
+        try:
+            if not prepared:
+                self._validate_code(input_data)
+            with metrics.span("sandbox_exec", agent="code"):
+                result = await self.sandbox.execute(input_data)
             return self._sanitize_output(result)
         except DockerSecurityException as e:
             raise CodeExecutionError(f"Security violation: {str(e)}") from e
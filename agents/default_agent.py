@@ -1,9 +1,13 @@
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from .base import Agent
 from utils.exceptions import ProcessingError
 
 class DefaultAgent(Agent):
-    async def execute(self, input_data: str) -> str:
+    @staticmethod
+    def required_params():
+        return []
+
+    async def execute(self, input_data: str, prepared: Optional[Any] = None) -> str:
         """Дефолтная обработка запроса"""
         try:
             return input_data  
@@ -1,9 +1,12 @@
 import fitz
 import os
+import re
+import asyncio
 from pathlib import Path
-from typing import Dict, Any
-from .base import Agent
+from typing import Dict, Any, Optional
+from .base import Agent, PreparedDocument
 from utils.exceptions import PDFProcessingError, ResourceLimitExceeded
+from utils.metrics import metrics
 
 class PDFFileAgent(Agent):
     MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
@@ -17,6 +20,7 @@ class PDFFileAgent(Agent):
         super().__init__(config)
         self.upload_dir = Path(config["upload_dir"])
         self.embedding_model = config["embedding_model"]
+        self.embedding_model_name = config.get("embedding_model_name", type(self.embedding_model).__name__)
         self._validate_upload_dir()
 
     def _validate_upload_dir(self):
@@ -26,15 +30,32 @@ class PDFFileAgent(Agent):
         if not os.access(self.upload_dir, os.W_OK):
             raise PDFProcessingError("Upload directory not writable")
 
-    async def execute(self, input_data: str) -> str:
-        """Обработка загруженного PDF"""
+    @property
+    def version(self) -> str:
+        return f"{super().version}:{PreparedDocument.version(self.embedding_model_name)}"
+
+    async def prepare(self, input_data: str) -> PreparedDocument:
+        """Парсинг и эмбеддинги загруженного документа"""
         try:
             file_path = self._validate_file(input_data)
-            text = self._parse_pdf(file_path)
-            return self._find_relevant_sections(text, input_data)
+            with metrics.span("pdf_parse", agent="pdf_file"):
+                text = await asyncio.to_thread(self._parse_pdf, file_path)
+            with metrics.span("embed", agent="pdf_file"):
+                return await asyncio.to_thread(PreparedDocument.build, text, self.embedding_model)
+        except PDFProcessingError:
+            raise
         except Exception as e:
             raise PDFProcessingError(str(e)) from e
 
+    async def execute(self, input_data: str, prepared: Optional[PreparedDocument] = None) -> str:
+        """Обработка загруженного PDF"""
+        document = prepared or await self.prepare(input_data)
+        try:
+            with metrics.span("rank", agent="pdf_file"):
+                return document.relevant_sections(input_data, self.embedding_model)
+        except Exception as e:
+            raise PDFProcessingError(f"Relevance search failed: {str(e)}") from e
+
     def _validate_file(self, input_data: str) -> Path:
         """Валидация загруженного файла"""
         file_match = re.search(r"<uploaded_file>(.+?)</uploaded_file>", input_data)
@@ -63,13 +84,7 @@ class PDFFileAgent(Agent):
     def _find_relevant_sections(self, text: str, query: str) -> str:
         """Поиск релевантных разделов"""
         try:
-            chunks = text.split("\n\n")
-            query_embedding = self.embedding_model.encode(query)
-            doc_embeddings = self.embedding_model.encode(chunks)
-            
-            scores = util.pytorch_cos_sim(query_embedding, doc_embeddings)[0]
-            top_indices = scores.argsort(descending=True)[:5]
-            
-            return "\n".join([chunks[i] for i in top_indices])
+            document = PreparedDocument.build(text, self.embedding_model)
+            return document.relevant_sections(query, self.embedding_model)
         except Exception as e:
             raise PDFProcessingError(f"Relevance search failed: {str(e)}")
\ No newline at end of file
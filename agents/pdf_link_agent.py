@@ -1,12 +1,13 @@
 import re
-import requests
+import asyncio
+import aiohttp
 import fitz
 from io import BytesIO
-from typing import Optional
-from sentence_transformers import util
-from .base import Agent
+from typing import Optional, Dict, Any
+from .base import Agent, PreparedDocument
 from utils.exceptions import (PDFProcessingError, NetworkError, 
                          ResourceLimitExceeded, SecurityException)
+from utils.metrics import metrics
 
 class PDFLinkAgent(Agent):
     MAX_PDF_SIZE = 10 * 1024 * 1024  # 10MB
@@ -19,17 +20,36 @@ class PDFLinkAgent(Agent):
     def __init__(self, config: Dict[str, Any]):
         super().__init__(config)
         self.embedding_model = config["embedding_model"]
+        self.embedding_model_name = config.get("embedding_model_name", type(self.embedding_model).__name__)
         
-    async def execute(self, input_data: str) -> str:
-        """Основной метод обработки PDF по ссылке"""
+    @property
+    def version(self) -> str:
+        return f"{super().version}:{PreparedDocument.version(self.embedding_model_name)}"
+
+    async def prepare(self, input_data: str) -> PreparedDocument:
+        """Загрузка, парсинг и эмбеддинги документа"""
         try:
             url = self._extract_url(input_data)
-            content = await self._download_pdf(url)
-            text = self._parse_pdf(content)
-            return self._find_relevant_sections(text, input_data)
+            with metrics.span("pdf_download", agent="pdf_link"):
+                content = await self._download_pdf(url)
+            with metrics.span("pdf_parse", agent="pdf_link"):
+                text = await asyncio.to_thread(self._parse_pdf, content)
+            with metrics.span("embed", agent="pdf_link"):
+                return await asyncio.to_thread(PreparedDocument.build, text, self.embedding_model)
+        except PDFProcessingError:
+            raise
         except Exception as e:
             raise PDFProcessingError(str(e)) from e
 
+    async def execute(self, input_data: str, prepared: Optional[PreparedDocument] = None) -> str:
+        """Основной метод обработки PDF по ссылке"""
+        document = prepared or await self.prepare(input_data)
+        try:
+            with metrics.span("rank", agent="pdf_link"):
+                return document.relevant_sections(input_data, self.embedding_model)
+        except Exception as e:
+            raise PDFProcessingError(f"Relevance search failed: {str(e)}") from e
+
     def _extract_url(self, text: str) -> str:
         """Извлечение PDF URL из текста"""
         match = re.search(r'(https?://\S+\.pdf)', text)
@@ -40,22 +60,23 @@ class PDFLinkAgent(Agent):
     async def _download_pdf(self, url: str) -> bytes:
         """Безопасная загрузка PDF"""
         try:
-            async with requests.Session() as session:
-                response = await session.get(
-                    url,
-                    stream=True,
-                    timeout=self.TIMEOUT,
-                    headers={"User-Agent": "Mozilla/5.0"}
-                )
-                response.raise_for_status()
+            timeout = aiohttp.ClientTimeout(total=self.TIMEOUT)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                async with session.get(url, headers={"User-Agent": "Mozilla/5.0"}) as response:
+                    response.raise_for_status()
 
-                if int(response.headers.get('Content-Length', 0)) > self.MAX_PDF_SIZE:
-                    raise ResourceLimitExceeded("PDF file size exceeds limit")
+                    if int(response.headers.get('Content-Length', 0)) > self.MAX_PDF_SIZE:
+                        raise ResourceLimitExceeded("PDF file size")
 
-                return await response.content.read()
+                    content = bytearray()
+                    async for chunk in response.content.iter_chunked(64 * 1024):
+                        content.extend(chunk)
+                        if len(content) > self.MAX_PDF_SIZE:
+                            raise ResourceLimitExceeded("PDF file size")
+                    return bytes(content)
 
-        except requests.RequestException as e:
-            raise NetworkError(f"Failed to download PDF: {str(e)}") from e
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise NetworkError(f"{url} ({str(e)})") from e
 
     def _parse_pdf(self, content: bytes) -> str:
         """Парсинг PDF контента"""
@@ -71,13 +92,7 @@ class PDFLinkAgent(Agent):
     def _find_relevant_sections(self, text: str, query: str) -> str:
         """Поиск релевантных разделов"""
         try:
-            chunks = text.split("\n\n")
-            query_embedding = self.embedding_model.encode(query)
-            doc_embeddings = self.embedding_model.encode(chunks)
-            
-            scores = util.pytorch_cos_sim(query_embedding, doc_embeddings)[0]
-            top_indices = scores.argsort(descending=True)[:5]
-            
-            return "\n".join([chunks[i] for i in top_indices])
+            document = PreparedDocument.build(text, self.embedding_model)
+            return document.relevant_sections(query, self.embedding_model)
         except Exception as e:
             raise PDFProcessingError(f"Relevance search failed: {str(e)}")
\ No newline at end of file
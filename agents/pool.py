@@ -0,0 +1,90 @@
+import asyncio
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional, TypeVar
+from .base import Agent
+from utils.exceptions import AgentOverloaded
+from utils.metrics import metrics
+
+T = TypeVar("T")
+
+# Внешний слот запроса (например, слот сервера). Пока задача агента
+# ждет или выполняется в пуле, слот отдается другим запросам: лимит
+# пула, а не общий лимит сервера, сдерживает медленные агенты.
+# Значение - объект с асинхронным контекстным менеджером yielded()
+outer_slot: ContextVar = ContextVar("agent_pool_outer_slot", default=None)
+
+POOL_CAPACITY = metrics.gauge("agent_pool_capacity", "Max concurrent jobs per agent type")
+POOL_IN_FLIGHT = metrics.gauge("agent_pool_in_flight", "Running jobs per agent type")
+POOL_QUEUED = metrics.gauge("agent_pool_queued", "Jobs waiting for a slot per agent type")
+POOL_BUSY_SECONDS = metrics.counter("agent_pool_busy_seconds_total", "Slot-seconds spent running jobs")
+POOL_REJECTED = metrics.counter("agent_pool_rejected_total", "Jobs rejected because the queue was full")
+POOL_WAIT = metrics.summary("agent_pool_wait_seconds", "Time spent waiting for a slot")
+
+class AgentPool:
+    """Долгоживущий экземпляр агента с собственным лимитом параллелизма.
+
+    Экземпляр создается один раз при первом обращении. Каждый тип
+    агента изолирован (bulkhead): не больше ``max_concurrency``
+    одновременных задач и ``max_queue`` ожидающих, остальные сразу
+    отклоняются, поэтому поток медленных PDF не блокирует код и
+    обычные вопросы. Утилизация: rate(busy_seconds) / capacity.
+    """
+    def __init__(
+        self,
+        name: str,
+        factory: Callable[[], Agent],
+        max_concurrency: int,
+        max_queue: int
+    ):
+        self.name = name
+        self.factory = factory
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.queued = 0
+        self._agent: Optional[Agent] = None
+        self._slots = asyncio.Semaphore(max_concurrency)
+        POOL_CAPACITY.set(max_concurrency, agent=name)
+
+    @property
+    def agent(self) -> Agent:
+        if self._agent is None:
+            self._agent = self.factory()
+        return self._agent
+
+    async def run(self, operation: Callable[[], Awaitable[T]]) -> T:
+        """Выполнение операции агента в пределах лимитов пула"""
+        if self.in_flight + self.queued >= self.max_concurrency + self.max_queue:
+            POOL_REJECTED.inc(agent=self.name)
+            raise AgentOverloaded(self.name)
+
+        outer = outer_slot.get()
+        async with (outer.yielded() if outer is not None else nullcontext()):
+            return await self._run(operation)
+
+    async def _run(self, operation: Callable[[], Awaitable[T]]) -> T:
+        self._track(queued=1)
+        wait_start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            self._track(queued=-1)
+            raise
+
+        self._track(queued=-1, in_flight=1)
+        start = time.perf_counter()
+        POOL_WAIT.observe(start - wait_start, agent=self.name)
+        try:
+            return await operation()
+        finally:
+            POOL_BUSY_SECONDS.inc(time.perf_counter() - start, agent=self.name)
+            self._slots.release()
+            self._track(in_flight=-1)
+
+    def _track(self, queued: int = 0, in_flight: int = 0):
+        self.queued += queued
+        self.in_flight += in_flight
+        POOL_QUEUED.set(self.queued, agent=self.name)
+        POOL_IN_FLIGHT.set(self.in_flight, agent=self.name)
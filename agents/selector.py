@@ -1,15 +1,41 @@
 import re
 import mimetypes
-from typing import Optional
+from typing import Optional, Dict, Any, Awaitable, Callable, TypeVar
+import config
 from .base import Agent
+from .pool import AgentPool
 from .pdf_link_agent import PDFLinkAgent
 from .code_exec_agent import CodeExecutionAgent
 from .pdf_file_agent import PDFFileAgent
 from .default_agent import DefaultAgent
 from utils.exceptions import AgentSelectionError, SecurityException
 
+T = TypeVar("T")
+
 class AgentSelector:
-    def __init__(self):
+    AGENT_TYPES = {
+        "pdf_link": PDFLinkAgent,
+        "code": CodeExecutionAgent,
+        "pdf_file": PDFFileAgent,
+        "default": DefaultAgent
+    }
+
+    def __init__(
+        self,
+        agent_config: Optional[Dict[str, Any]] = None,
+        pool_limits: Optional[Dict[str, Dict[str, int]]] = None
+    ):
+        self.agent_config = agent_config or {}
+        limits = pool_limits or config.AGENT_POOLS
+        self.pools = {
+            name: AgentPool(
+                name,
+                lambda cls=cls: cls(self.agent_config),
+                **limits[name]
+            )
+            for name, cls in self.AGENT_TYPES.items()
+        }
+        self._pool_by_type = {cls: self.pools[name] for name, cls in self.AGENT_TYPES.items()}
         self.code_patterns = [
             r'(def\s+\w+\s*\(.*\):)',
             r'(class\s+\w+)',
@@ -26,19 +52,23 @@ class AgentSelector:
             
             # Определение типа задачи
             if self._is_pdf_url(prompt):
-                return PDFLinkAgent()
+                return self.pools["pdf_link"].agent
                 
             if self._is_code(prompt):
-                return CodeExecutionAgent()
+                return self.pools["code"].agent
                 
             if self._has_uploaded_file(prompt):
                 return self._handle_file_upload(prompt)
                 
-            return DefaultAgent()
+            return self.pools["default"].agent
             
         except Exception as e:
             raise AgentSelectionError(f"Agent selection failed: {str(e)}")
 
+    async def dispatch(self, agent: Agent, operation: Callable[[], Awaitable[T]]) -> T:
+        """Выполнение операции агента в пуле его типа"""
+        return await self._pool_by_type[type(agent)].run(operation)
+
     def _check_prompt_safety(self, prompt: str):
         forbidden_patterns = [
             r'(\/etc\/passwd)',
@@ -63,9 +93,9 @@ class AgentSelector:
         mime_type, _ = mimetypes.guess_type(file_info['name'])
         
         if mime_type == 'application/pdf':
-            return PDFFileAgent()
+            return self.pools["pdf_file"].agent
         elif mime_type in ['text/plain', 'text/x-python']:
-            return CodeExecutionAgent()
+            return self.pools["code"].agent
             
         raise AgentSelectionError(f"Unsupported file type: {mime_type}")
 
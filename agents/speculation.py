@@ -0,0 +1,77 @@
+import asyncio
+import time
+from contextlib import suppress
+from typing import Any, Optional
+from .base import Agent
+from .pdf_link_agent import PDFLinkAgent
+from .pdf_file_agent import PDFFileAgent
+from .code_exec_agent import CodeExecutionAgent
+from .pool import outer_slot
+from utils.metrics import metrics
+
+SPECULATIONS = metrics.counter("speculation_total", "Speculative agent preparations by outcome")
+SAVED_SECONDS = metrics.summary("speculation_saved_seconds", "Agent preparation time overlapped with sanitization")
+
+class AgentSpeculation:
+    """Спекулятивная подготовка агента параллельно с санитайзингом.
+
+    Запускается только ``Agent.prepare`` (загрузка, хэширование, парсинг,
+    эмбеддинги), который не обращается к LLM и песочнице. Результат
+    используется только если санитайзер пропустил ровно тот же текст;
+    иначе задача отменяется, а ее результат отбрасывается.
+    """
+    SPECULATIVE_AGENTS = (PDFLinkAgent, PDFFileAgent, CodeExecutionAgent)
+
+    def __init__(self, selector, agent: Agent, user_input: str):
+        self.selector = selector
+        self.agent = agent
+        self.user_input = user_input
+        self.started_at = time.perf_counter()
+        self.finished_at: Optional[float] = None
+        self.task = asyncio.create_task(self._run())
+
+    @classmethod
+    def start(cls, selector, user_input: str) -> Optional["AgentSpeculation"]:
+        try:
+            agent = selector.select_agent(user_input)
+        except Exception:
+            return None
+        if not isinstance(agent, cls.SPECULATIVE_AGENTS):
+            return None
+        return cls(selector, agent, user_input)
+
+    async def _run(self) -> Any:
+        # Задача унаследовала слот запроса, но держит его основная
+        # задача (санитайзинг), поэтому пул не должен его отдавать
+        outer_slot.set(None)
+        try:
+            return await self.selector.dispatch(
+                self.agent,
+                lambda: self.agent.prepare(self.user_input)
+            )
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def matches(self, clean_input: str) -> bool:
+        return clean_input == self.user_input and not self.task.cancelled()
+
+    def mark_cleared(self):
+        """Санитайзинг пройден: учет времени, сэкономленного перекрытием"""
+        cleared_at = time.perf_counter()
+        finished_at = self.finished_at or cleared_at
+        SAVED_SECONDS.observe(min(finished_at, cleared_at) - self.started_at)
+
+    async def result(self) -> Any:
+        SPECULATIONS.inc(outcome="used")
+        return await self.task
+
+    async def cancel(self, outcome: str = "cancelled"):
+        if self.task.done():
+            if not self.task.cancelled():
+                # Исключение отброшенной подготовки не должно всплывать
+                self.task.exception()
+            return
+        SPECULATIONS.inc(outcome=outcome)
+        self.task.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await self.task
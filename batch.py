@@ -0,0 +1,311 @@
+"""Пакетная обработка JSONL-файла запросов.
+
+    python batch.py requests.jsonl results.jsonl
+
+Каждая строка входного файла - JSON-объект с полем ``input`` и
+необязательным ``id``. Файл читается порциями, поэтому память не
+зависит от его размера. Внутри порции запросы группируются по типу
+агента и документу: каждый PDF загружается, парсится и эмбеддится
+один раз для всех вопросов к нему (последние подготовленные документы
+хранятся и между порциями), а генерация LLM идет пакетами.
+Результаты дописываются в выходной JSONL после каждой порции, а
+контрольная точка позволяет продолжить работу после падения.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+import config
+from agents.base import Agent, PreparedDocument
+from agents.pdf_link_agent import PDFLinkAgent
+from agents.pdf_file_agent import PDFFileAgent
+from sanitizer.prompt_sanitizer import SanitizationPipeline
+from utils.exceptions import ProcessingError
+from utils.metrics import metrics
+
+BATCH_REQUESTS = metrics.counter("batch_requests_total", "Batch requests by outcome")
+BATCH_DOCUMENTS = metrics.counter("batch_documents_prepared_total", "Documents prepared once per group")
+
+class BatchItem:
+    def __init__(self, item_id: Any, user_input: str):
+        self.id = item_id
+        self.input = user_input
+        self.agent: Optional[Agent] = None
+        self.context: Optional[str] = None
+        self.response: Optional[str] = None
+        self.error: Optional[str] = None
+
+    def to_record(self) -> Dict[str, Any]:
+        if self.error is not None:
+            return {"id": self.id, "error": self.error}
+        return {"id": self.id, "response": self.response}
+
+class BatchRunner:
+    def __init__(
+        self,
+        orchestrator,
+        chunk_size: int = config.BATCH_CHUNK_SIZE,
+        llm_batch_size: int = config.BATCH_LLM_BATCH_SIZE,
+        refine: bool = True,
+        refine_concurrency: int = config.BATCH_REFINE_CONCURRENCY,
+        document_cache_size: int = config.BATCH_DOCUMENT_CACHE
+    ):
+        self.orchestrator = orchestrator
+        self.chunk_size = chunk_size
+        self.llm_batch_size = llm_batch_size
+        self.refine = refine
+        self.refine_concurrency = refine_concurrency
+        self.document_cache_size = document_cache_size
+        self._documents: "OrderedDict[Tuple[str, str], PreparedDocument]" = OrderedDict()
+
+    async def run(self, input_path: str, output_path: str, checkpoint_path: Optional[str] = None) -> Dict[str, Any]:
+        checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+        state, resumed = self._load_checkpoint(checkpoint_path, input_path, output_path)
+        start = time.perf_counter()
+        processed_now = 0
+
+        with open(output_path, "ab") as out:
+            size = out.seek(0, os.SEEK_END)
+            if not resumed:
+                # Без своей контрольной точки чужие записи не трогаем
+                state["output_offset"] = size
+            elif size < state["output_offset"]:
+                raise ProcessingError(
+                    f"Output {output_path} is shorter than its checkpoint; "
+                    f"remove {checkpoint_path} to start over"
+                )
+            else:
+                # После падения выходной файл обрезается до последней
+                # подтвержденной контрольной точки: записи не дублируются
+                out.truncate(state["output_offset"])
+
+        with open(input_path, "rb") as source, open(output_path, "ab") as out:
+            source.seek(state["input_offset"])
+            line_number = state["processed"]
+            while True:
+                chunk = []
+                while len(chunk) < self.chunk_size:
+                    line = source.readline()
+                    if not line:
+                        break
+                    line_number += 1
+                    if line.strip():
+                        chunk.append(self._parse_line(line, line_number))
+                if not chunk:
+                    break
+
+                await self.process_chunk(chunk)
+                out.write("".join(
+                    json.dumps(item.to_record(), ensure_ascii=False) + "\n" for item in chunk
+                ).encode())
+                out.flush()
+                os.fsync(out.fileno())
+
+                state.update(
+                    input_offset=source.tell(),
+                    output_offset=out.tell(),
+                    processed=line_number
+                )
+                self._save_checkpoint(checkpoint_path, state)
+                processed_now += len(chunk)
+
+        elapsed = time.perf_counter() - start
+        return {
+            "processed": processed_now,
+            "total_lines": state["processed"],
+            "elapsed_s": elapsed,
+            "requests_per_hour": processed_now / elapsed * 3600 if elapsed else 0.0
+        }
+
+    async def process_chunk(self, chunk: List[BatchItem]):
+        self._sanitize(chunk)
+        allowed = [item for item in chunk if item.error is None]
+
+        for item in allowed:
+            try:
+                item.agent = self.orchestrator.selector.select_agent(item.input)
+            except ProcessingError as e:
+                item.error = str(e)
+
+        await self._build_contexts([item for item in allowed if item.error is None])
+        await self._generate([item for item in allowed if item.error is None])
+        if self.refine:
+            await self._refine([item for item in allowed if item.error is None])
+
+        for item in chunk:
+            BATCH_REQUESTS.inc(outcome="error" if item.error else "ok")
+
+    def _sanitize(self, chunk: List[BatchItem]):
+        # Строки, которые не разобрались, сохраняют свою ошибку
+        pending = [item for item in chunk if item.error is None]
+        sanitizer = SanitizationPipeline.get_sanitizer()
+        for item, verdict in zip(pending, sanitizer.check_many([item.input for item in pending])):
+            if verdict:
+                item.error = f"Request blocked for security reasons: {verdict}"
+
+    async def _build_contexts(self, items: List[BatchItem]):
+        """Один prepare на документ, затем execute для каждого вопроса"""
+        groups: "OrderedDict[Tuple[str, Optional[str]], List[BatchItem]]" = OrderedDict()
+        for item in items:
+            key = (type(item.agent).__name__, self._document_key(item))
+            groups.setdefault(key, []).append(item)
+
+        selector = self.orchestrator.selector
+        for key, group in groups.items():
+            agent = group[0].agent
+            prepared = None
+            if key[1] is not None:
+                try:
+                    prepared = await self._prepare(key, agent, group[0].input)
+                except ProcessingError as e:
+                    for item in group:
+                        item.error = str(e)
+                    continue
+
+            for item in group:
+                try:
+                    item.context = await selector.dispatch(
+                        agent,
+                        lambda: agent.execute(item.input, prepared)
+                    )
+                except ProcessingError as e:
+                    item.error = str(e)
+
+    async def _prepare(self, key: Tuple[str, str], agent: Agent, user_input: str) -> PreparedDocument:
+        """Подготовка документа с LRU между порциями"""
+        prepared = self._documents.get(key)
+        if prepared is not None:
+            self._documents.move_to_end(key)
+            return prepared
+
+        prepared = await self.orchestrator.selector.dispatch(agent, lambda: agent.prepare(user_input))
+        BATCH_DOCUMENTS.inc(agent=type(agent).__name__)
+        if self.document_cache_size > 0:
+            self._documents[key] = prepared
+            while len(self._documents) > self.document_cache_size:
+                self._documents.popitem(last=False)
+        return prepared
+
+    async def _generate(self, items: List[BatchItem]):
+        by_mode: Dict[str, List[BatchItem]] = {}
+        for item in items:
+            by_mode.setdefault(self.orchestrator._get_mode(item.agent), []).append(item)
+
+        for mode, group in by_mode.items():
+            for i in range(0, len(group), self.llm_batch_size):
+                batch = group[i:i + self.llm_batch_size]
+                try:
+                    responses = await self.orchestrator.llm.generate_batch_async(
+                        [item.input for item in batch],
+                        [item.context for item in batch],
+                        mode
+                    )
+                except Exception as e:
+                    for item in batch:
+                        item.error = f"Generation failed: {str(e)}"
+                    continue
+                for item, response in zip(batch, responses):
+                    item.response = response
+
+    async def _refine(self, items: List[BatchItem]):
+        """Доработка SocietyMind, до refine_concurrency запросов одновременно"""
+        slots = asyncio.Semaphore(max(1, self.refine_concurrency))
+
+        async def refine(item: BatchItem):
+            async with slots:
+                try:
+                    item.response = await self.orchestrator.society.refine_response(
+                        query=item.input,
+                        context=item.context,
+                        initial_response=item.response
+                    )
+                except Exception as e:
+                    item.error = f"Refinement failed: {str(e)}"
+
+        await asyncio.gather(*(refine(item) for item in items))
+
+    @staticmethod
+    def _document_key(item: BatchItem) -> Optional[str]:
+        if isinstance(item.agent, PDFLinkAgent):
+            try:
+                return item.agent._extract_url(item.input)
+            except ProcessingError:
+                return None
+        if isinstance(item.agent, PDFFileAgent):
+            match = re.search(r"<uploaded_file>(.+?)</uploaded_file>", item.input)
+            return match.group(1) if match else None
+        return None
+
+    @staticmethod
+    def _parse_line(line: bytes, line_number: int) -> BatchItem:
+        try:
+            record = json.loads(line)
+            user_input = record["input"]
+            if not isinstance(user_input, str):
+                raise TypeError("'input' must be a string")
+        except (ValueError, KeyError, TypeError) as e:
+            item = BatchItem(line_number, "")
+            item.error = f"Invalid request line: {str(e)}"
+            return item
+        return BatchItem(record.get("id", line_number), user_input)
+
+    @staticmethod
+    def _load_checkpoint(
+        checkpoint_path: str,
+        input_path: str,
+        output_path: str
+    ) -> Tuple[Dict[str, Any], bool]:
+        """Состояние и признак продолжения по контрольной точке этой
+        же пары входного и выходного файлов"""
+        paths = {
+            "input": str(Path(input_path).resolve()),
+            "output": str(Path(output_path).resolve())
+        }
+        try:
+            with open(checkpoint_path) as f:
+                state = json.load(f)
+            if all(state.get(name) == path for name, path in paths.items()):
+                return state, True
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return dict(paths, input_offset=0, output_offset=0, processed=0), False
+
+    @staticmethod
+    def _save_checkpoint(checkpoint_path: str, state: Dict[str, Any]):
+        tmp_path = f"{checkpoint_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, checkpoint_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="MindForce batch mode")
+    parser.add_argument("input", help="JSONL file with {\"id\", \"input\"} records")
+    parser.add_argument("output", help="JSONL file for results (appended)")
+    parser.add_argument("--checkpoint", help="Checkpoint path (default: <output>.checkpoint)")
+    parser.add_argument("--chunk-size", type=int, default=config.BATCH_CHUNK_SIZE)
+    parser.add_argument("--llm-batch-size", type=int, default=config.BATCH_LLM_BATCH_SIZE)
+    parser.add_argument("--no-refine", action="store_true", help="Skip SocietyMind refinement")
+    parser.add_argument("--refine-concurrency", type=int, default=config.BATCH_REFINE_CONCURRENCY)
+    args = parser.parse_args()
+
+    from main import AIOrchestrator
+
+    runner = BatchRunner(
+        AIOrchestrator(),
+        chunk_size=args.chunk_size,
+        llm_batch_size=args.llm_batch_size,
+        refine=not args.no_refine,
+        refine_concurrency=args.refine_concurrency
+    )
+    summary = asyncio.run(runner.run(args.input, args.output, args.checkpoint))
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
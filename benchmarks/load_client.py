@@ -0,0 +1,64 @@
+"""Синтетическая нагрузка на сервер (python main.py --serve).
+
+    python -m benchmarks.load_client --url http://127.0.0.1:8080/ask --requests 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+
+import aiohttp
+
+PROMPTS = [
+    "what does this paper conclude?",
+    "summarize the main idea of the method",
+    "explain the result in simple words",
+]
+
+async def run(url: str, total: int, concurrency: int, timeout: float) -> dict:
+    statuses = Counter()
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+
+    async with aiohttp.ClientSession(timeout=client_timeout) as session:
+        async def one(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.post(url, json={"input": f"{PROMPTS[i % len(PROMPTS)]} #{i}"}) as response:
+                        await response.read()
+                        statuses[response.status] += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+
+    ordered = sorted(latencies)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "throughput_rps": total / elapsed,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000,
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "statuses": {str(k): v for k, v in statuses.items()}
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic load client")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/ask")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.requests, args.concurrency, args.timeout)), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""Генерация тестовых PDF"""
+import random
+from pathlib import Path
+
+import fitz
+
+from .stubs import WORDS
+
+def paragraph(rng: random.Random, words: int = 60) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+def generate_pdf(path: Path, pages: int, seed: int = 0) -> Path:
+    """PDF из ``pages`` страниц по несколько абзацев на каждой"""
+    rng = random.Random(seed)
+    doc = fitz.open()
+    for _ in range(pages):
+        page = doc.new_page()
+        text = "\n\n".join(paragraph(rng) for _ in range(4))
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=9)
+    doc.save(str(path))
+    doc.close()
+    return path
@@ -0,0 +1,548 @@
+"""Офлайн-бенчмарки стадий конвейера.
+
+Запуск из корня репозитория::
+
+    python -m benchmarks.run --quick
+    python -m benchmarks.run --update-baseline
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.25
+
+Все модели заменены маленькими случайно инициализированными
+аналогами (см. ``benchmarks/stubs.py``), сеть и Docker не нужны.
+Результаты пишутся в JSON; при сравнении с базовой линией процесс
+завершается с кодом 1, если медиана какой-либо стадии выросла больше
+допустимого. Быстрый прогон сравнивается только с базовой линией,
+снятой тоже с ``--quick``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+BENCHMARKS: Dict[str, Callable] = {}
+
+def benchmark(name: str):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+def summarize(samples: List[float], **extra) -> Dict[str, Any]:
+    ordered = sorted(samples)
+    result = {
+        "runs": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1000,
+        "min_ms": ordered[0] * 1000
+    }
+    result.update(extra)
+    return result
+
+def measure(fn: Callable, repeats: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def ameasure(fn: Callable, repeats: int, warmup: int = 1) -> List[float]:
+    return measure(lambda: asyncio.run(fn()), repeats, warmup)
+
+class BenchContext:
+    """Общие заглушки и рабочая директория бенчмарков"""
+    def __init__(self, workdir: Path, quick: bool, embedding_model: str = None):
+        from . import stubs
+        self.workdir = workdir
+        self.quick = quick
+        self.repeats = 3 if quick else 20
+        self.tokenizer = stubs.build_tokenizer()
+        # От 32 до 64 новых токенов на вызов: генерация измеряется,
+        # но полный прогон не растягивается до бюджетов в 300-500 токенов
+        from llm.policy import GenerationPolicy
+        self.llm = stubs.build_llm(
+            self.tokenizer,
+            policy=GenerationPolicy(budgets={role: 64 for role in GenerationPolicy.DEFAULT_BUDGETS})
+        )
+        self.sanitizer = stubs.build_sanitizer(self.tokenizer)
+        self.embedder = stubs.StubEmbedder()
+        # Для оценки порога семантического кэша можно подставить
+        # настоящую модель (--embedding-model all-MiniLM-L6-v2)
+        self.embedding_model_name = embedding_model or "stub"
+        self.embedding_model = self.embedder
+        if embedding_model:
+            from sentence_transformers import SentenceTransformer
+            self.embedding_model = SentenceTransformer(embedding_model)
+        self.docker = stubs.FakeDockerClient()
+        self.agent_config = {
+            "embedding_model": self.embedder,
+            "upload_dir": str(workdir / "uploads"),
+            "docker_config": {"client": self.docker}
+        }
+
+PROMPTS = {
+    "short": "what does this paper conclude?",
+    "long": " ".join(["what is the result of the analysis in this section"] * 400),
+    "pdf_link": "summarize https://example.com/papers/report.pdf please",
+    "code": "def add(a, b):\n    return a + b\nprint(add(1, 2))",
+    "upload": "what is the conclusion? <uploaded_file>report.pdf</uploaded_file>",
+}
+
+@benchmark("sanitize")
+def bench_sanitize(ctx: BenchContext) -> Dict[str, Any]:
+    from sanitizer.prompt_sanitizer import SanitizationPipeline
+    SanitizationPipeline.configure(ctx.sanitizer)
+    return {
+        f"sanitize_{name}": summarize(ameasure(
+            lambda p=PROMPTS[name]: SanitizationPipeline.process(p), ctx.repeats
+        ))
+        for name in ("short", "long")
+    }
+
+@benchmark("sanitizer_quant")
+def bench_sanitizer_quant(ctx: BenchContext) -> Dict[str, Any]:
+    """fp32 против int8 и скользящих окон против обрезки до 512 токенов.
+
+    По умолчанию используется случайная модель-заглушка шириной 128:
+    на более узкой накладные расходы квантизации больше выигрыша.
+    Классификатор заглушки калибруется так, чтобы оценки fp32 лежали
+    по обе стороны порога и сравнение вердиктов имело смысл.
+    Согласие int8 с fp32 дается на пороге и на квартилях оценок fp32,
+    плюс корреляция оценок. Путь к настоящей модели можно задать через
+    MINDFORCE_SANITIZER_MODEL.
+    """
+    import copy
+    import random
+    import numpy as np
+    import torch
+    from sanitizer.prompt_sanitizer import PromptSanitizer
+    from .stubs import WORDS, build_sanitizer, calibrate_sanitizer
+
+    rng = random.Random(0)
+    inputs = {
+        "short": [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40))) for _ in range(32)],
+        "long": [" ".join(rng.choice(WORDS) for _ in range(rng.randint(400, 1500))) for _ in range(16)],
+        "very_long": [" ".join(rng.choice(WORDS) for _ in range(20000)) for _ in range(2)]
+    }
+
+    model_path = os.environ.get("MINDFORCE_SANITIZER_MODEL")
+    if model_path:
+        fp32 = PromptSanitizer(model_path, quantize=False)
+    else:
+        fp32 = build_sanitizer(ctx.tokenizer, quantize=False, hidden_size=128)
+        calibrate_sanitizer(fp32, inputs["short"] + inputs["long"], PromptSanitizer.THRESHOLD)
+    int8 = PromptSanitizer(tokenizer=fp32.tokenizer, model=copy.deepcopy(fp32.model), quantize=True)
+
+    def legacy_score(text: str) -> float:
+        inputs = fp32.tokenizer(text, return_tensors="pt", max_length=512, truncation=True)
+        with torch.no_grad():
+            logits = fp32.model(**inputs).logits
+        return torch.softmax(logits, dim=1)[0][1].item()
+
+    def agreement(a: List[float], b: List[float], threshold: float) -> float:
+        return sum((x > threshold) == (y > threshold) for x, y in zip(a, b)) / len(a)
+
+    results = {}
+    for kind, texts in inputs.items():
+        repeats = ctx.repeats if kind == "short" else max(1, ctx.repeats // 5)
+        results[f"sanitizer_truncated_fp32_{kind}"] = summarize(
+            measure(lambda: [legacy_score(t) for t in texts], repeats)
+        )
+        results[f"sanitizer_windowed_fp32_{kind}"] = summarize(
+            measure(lambda: fp32.score_many(texts), repeats)
+        )
+        fp32_scores = fp32.score_many(texts)
+        int8_scores = int8.score_many(texts)
+        quartiles = np.quantile(fp32_scores, [0.25, 0.5, 0.75])
+        correlation = float(np.corrcoef(fp32_scores, int8_scores)[0, 1]) if len(texts) > 2 else None
+        results[f"sanitizer_windowed_int8_{kind}"] = summarize(
+            measure(lambda: int8.score_many(texts), repeats),
+            verdict_agreement=agreement(fp32_scores, int8_scores, PromptSanitizer.THRESHOLD),
+            blocked_share_fp32=sum(s > PromptSanitizer.THRESHOLD for s in fp32_scores) / len(texts),
+            agreement_at_quartiles=[agreement(fp32_scores, int8_scores, q) for q in quartiles],
+            score_correlation=correlation,
+            max_score_diff=max(abs(a - b) for a, b in zip(fp32_scores, int8_scores)),
+            texts=len(texts),
+            quantized=int8.quantized
+        )
+    return results
+
+@benchmark("select_agent")
+def bench_select_agent(ctx: BenchContext) -> Dict[str, Any]:
+    from agents.selector import AgentSelector
+    selector = AgentSelector(ctx.agent_config)
+    return {
+        f"select_agent_{name}": summarize(measure(
+            lambda p=PROMPTS[name]: selector.select_agent(p), ctx.repeats * 10
+        ))
+        for name in ("short", "pdf_link", "code", "upload")
+    }
+
+@benchmark("pdf")
+def bench_pdf(ctx: BenchContext) -> Dict[str, Any]:
+    from agents.pdf_file_agent import PDFFileAgent
+    from .pdfs import generate_pdf
+    agent = PDFFileAgent(ctx.agent_config)
+    results = {}
+    for pages in ((10, 100) if ctx.quick else (10, 100, 1000)):
+        path = generate_pdf(ctx.workdir / f"doc_{pages}.pdf", pages)
+        text = agent._parse_pdf(path)
+        repeats = max(1, ctx.repeats // (10 if pages >= 1000 else 1))
+        results[f"pdf_parse_{pages}p"] = summarize(
+            measure(lambda: agent._parse_pdf(path), repeats), pages=pages
+        )
+        results[f"pdf_relevant_sections_{pages}p"] = summarize(
+            measure(lambda: agent._find_relevant_sections(text, PROMPTS["short"]), repeats),
+            pages=pages
+        )
+    return results
+
+@benchmark("cache")
+def bench_cache(ctx: BenchContext) -> Dict[str, Any]:
+    from utils.cache import SmartCache
+    cache = SmartCache(cache_dir=str(ctx.workdir / "bench_cache"))
+    payload = "x" * 4000
+    keys = [cache.generate_key(f"prompt {i}", "", "v", "no_data") for i in range(ctx.repeats * 10)]
+    writes = iter(keys * 2)
+    reads = iter(keys * 2)
+    return {
+        "smart_cache_write": summarize(measure(lambda: cache.save_cache(next(writes), payload), len(keys), warmup=0)),
+        "smart_cache_read": summarize(measure(lambda: cache.check_cache(next(reads)), len(keys), warmup=0))
+    }
+
+@benchmark("semantic_cache")
+def bench_semantic_cache(ctx: BenchContext) -> Dict[str, Any]:
+    """Поиск в LSH-индексе на 100k записей и качество порога на размеченных перефразах"""
+    import numpy as np
+    from utils.cache import SemanticCache, SemanticIndex
+
+    size, dim = 100_000, 384
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((size, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index = SemanticIndex(dim=dim, max_entries=size)
+    start = time.perf_counter()
+    for i, vector in enumerate(vectors):
+        index.add(vector, str(i))
+    build_s = time.perf_counter() - start
+
+    # Запросы - зашумленные копии сохраненных векторов (косинус ~0.95)
+    targets = rng.choice(size, 200 if ctx.quick else 1000, replace=False)
+    queries = vectors[targets] + 0.33 / np.sqrt(dim) * rng.standard_normal((len(targets), dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    samples, hits = [], 0
+    for target, query in zip(targets, queries):
+        start = time.perf_counter()
+        matches = index.search(query)
+        samples.append(time.perf_counter() - start)
+        hits += bool(matches) and matches[0][0] == str(target)
+
+    with open(REPO_ROOT / "benchmarks" / "fixtures" / "paraphrases.jsonl") as f:
+        pairs = [json.loads(line) for line in f if line.strip()]
+    cache = SemanticCache(embedding_model=ctx.embedding_model, persist_dir=None)
+    labelled = [(p["first"], p["second"], p["paraphrase"]) for p in pairs]
+    quality = {}
+    # Сходство векторов заглушки не связано со смыслом текста, поэтому
+    # precision/recall порога считаются только с настоящей моделью
+    if ctx.embedding_model_name != "stub":
+        quality = {
+            f"threshold_{threshold}": SemanticCache(
+                embedding_model=ctx.embedding_model, threshold=threshold, persist_dir=None
+            ).evaluate(labelled)
+            for threshold in (0.8, 0.85, 0.9, cache.threshold)
+        }
+    return {
+        "semantic_index_search_100k": summarize(samples, recall_at_1=hits / len(targets), build_s=build_s),
+        "semantic_cache_paraphrases": summarize(
+            measure(lambda: cache.evaluate(labelled), ctx.repeats),
+            embedding_model=ctx.embedding_model_name,
+            pairs=len(labelled),
+            **({"quality": quality} if quality else {})
+        )
+    }
+
+@benchmark("society")
+def bench_society(ctx: BenchContext) -> Dict[str, Any]:
+    from society_mind.autogen_society import SocietyMind
+    society = SocietyMind(ctx.llm, max_rounds=1, similarity_model=ctx.embedder)
+    return {
+        "society_refine": summarize(ameasure(
+            lambda: society.refine_response(
+                query=PROMPTS["short"],
+                context="the paper result is a method for data analysis",
+                initial_response="the paper concludes that the method works"
+            ),
+            max(1, ctx.repeats // 3)
+        ))
+    }
+
+@benchmark("assisted")
+def bench_assisted(ctx: BenchContext) -> Dict[str, Any]:
+    """Ассистированное декодирование с согласованной и случайной черновой моделью"""
+    from . import stubs
+    prompt = " ".join([PROMPTS["short"]] * 10)
+    # Не меньше min_calls + 1 вызовов на роль, чтобы была и обычная генерация
+    calls = max(4, ctx.repeats)
+    results = {}
+    for paired in (True, False):
+        llm = stubs.build_llm_pair(ctx.tokenizer, paired=paired)
+        samples = []
+        for i in range(calls):
+            for role in ("critic", "generator", "finalizer"):
+                start = time.perf_counter()
+                llm.generate_raw(f"{prompt} {i}", role, max_new_tokens=48, min_new_tokens=48)
+                samples.append(time.perf_counter() - start)
+        name = "assisted_paired" if paired else "assisted_unpaired"
+        results[name] = summarize(samples, roles=llm.assist_stats())
+    return results
+
+@benchmark("generation_policy")
+def bench_generation_policy(ctx: BenchContext) -> Dict[str, Any]:
+    """SocietyMind с фиксированными и обученными бюджетами токенов.
+
+    Случайная модель почти не выдает EOS, поэтому бюджеты обучаются на
+    синтетическом распределении длин ответов по ролям.
+    """
+    import random
+    from llm.phi_wrapper import PhiLLM
+    from llm.policy import GenerationPolicy
+    from society_mind.autogen_society import SocietyMind
+    from . import stubs
+
+    rng = random.Random(0)
+    typical = {"critic": (90, 20), "generator": (160, 40), "finalizer": (180, 40)}
+    results = {}
+    for adaptive in (False, True):
+        policy = GenerationPolicy(adaptive=adaptive)
+        for role, (mean, std) in typical.items():
+            for _ in range(policy.min_samples):
+                length = max(1, int(rng.gauss(mean, std)))
+                policy.observe(role, length, policy.budget(role), 0.0, "eos")
+        # Без min_new_tokens случайная модель сама выдает EOS, как
+        # настоящая модель на коротких ответах
+        llm = stubs.build_llm(ctx.tokenizer, policy=policy, min_new_tokens=0)
+        society = SocietyMind(llm, max_rounds=1, similarity_model=ctx.embedder)
+        tokens = []
+
+        async def refine():
+            with PhiLLM.count_request_tokens() as tally:
+                await society.refine_response(
+                    query=PROMPTS["short"],
+                    context="the paper result is a method for data analysis",
+                    initial_response="the paper concludes that the method works"
+                )
+            tokens.append(tally[0])
+
+        samples = ameasure(refine, max(1, ctx.repeats // 3))
+        name = "society_policy_adaptive" if adaptive else "society_policy_fixed"
+        results[name] = summarize(
+            samples,
+            tokens_per_request=statistics.fmean(tokens),
+            budgets={role: policy.budget(role) for role in typical}
+        )
+    return results
+
+@benchmark("orchestrator")
+def bench_orchestrator(ctx: BenchContext) -> Dict[str, Any]:
+    from main import AIOrchestrator
+    from agents.selector import AgentSelector
+    from sanitizer.prompt_sanitizer import SanitizationPipeline
+    from society_mind.autogen_society import SocietyMind
+    from utils.cache import CacheManager, SemanticCache, SmartCache
+    from utils.stages import StageMemo
+
+    SanitizationPipeline.configure(ctx.sanitizer)
+    orchestrator = AIOrchestrator(
+        llm=ctx.llm,
+        selector=AgentSelector(ctx.agent_config),
+        society=SocietyMind(ctx.llm, max_rounds=1, similarity_model=ctx.embedder),
+        cache_manager=CacheManager(ctx.llm, SemanticCache(embedding_model=ctx.embedder)),
+        memo=StageMemo(SmartCache(cache_dir=str(ctx.workdir / "stages")))
+    )
+    orchestrator.cache_enabled = False
+
+    results = {}
+    counter = iter(range(10 ** 9))
+    for concurrency in ((1, 4) if ctx.quick else (1, 4, 16)):
+        requests = concurrency * (1 if ctx.quick else 2)
+
+        async def run_batch():
+            latencies = []
+
+            async def one():
+                # Уникальный промпт, чтобы мемоизация стадий не срабатывала
+                prompt = f"{PROMPTS['short']} {next(counter)}"
+                start = time.perf_counter()
+                await orchestrator.process_request(prompt)
+                latencies.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def limited():
+                async with semaphore:
+                    await one()
+
+            await asyncio.gather(*(limited() for _ in range(requests)))
+            return latencies, time.perf_counter() - start
+
+        latencies, elapsed = asyncio.run(run_batch())
+        results[f"orchestrator_c{concurrency}"] = summarize(
+            latencies,
+            concurrency=concurrency,
+            throughput_rps=requests / elapsed
+        )
+    return results
+
+@benchmark("speculation")
+def bench_speculation(ctx: BenchContext) -> Dict[str, Any]:
+    """PDF по ссылке с подготовкой агента последовательно и параллельно
+    с санитайзингом; загрузка заменена задержкой"""
+    from main import AIOrchestrator
+    from agents.pdf_link_agent import PDFLinkAgent
+    from agents.selector import AgentSelector
+    from sanitizer.prompt_sanitizer import SanitizationPipeline
+    from society_mind.autogen_society import SocietyMind
+    from utils.cache import CacheManager, SemanticCache, SmartCache
+    from utils.stages import StageMemo, StageTrace
+    from .pdfs import generate_pdf
+
+    pdf_bytes = generate_pdf(ctx.workdir / "linked.pdf", 20).read_bytes()
+
+    async def fake_download(self, url):
+        await asyncio.sleep(0.05)
+        return pdf_bytes
+
+    SanitizationPipeline.configure(ctx.sanitizer)
+    original_download = PDFLinkAgent._download_pdf
+    PDFLinkAgent._download_pdf = fake_download
+    results = {}
+    try:
+        for speculative in (False, True):
+            orchestrator = AIOrchestrator(
+                llm=ctx.llm,
+                selector=AgentSelector(ctx.agent_config),
+                society=SocietyMind(ctx.llm, max_rounds=0, similarity_model=ctx.embedder),
+                cache_manager=CacheManager(ctx.llm, SemanticCache(embedding_model=ctx.embedder)),
+                memo=StageMemo(SmartCache(cache_dir=str(ctx.workdir / f"spec_{speculative}")))
+            )
+            orchestrator.cache_enabled = False
+            orchestrator.speculative = speculative
+            counter = iter(range(10 ** 9))
+            prompt = PROMPTS["long"] + " " + PROMPTS["pdf_link"]
+            traces = []
+
+            async def one():
+                trace = StageTrace()
+                traces.append(trace)
+                await orchestrator.process_request(f"{prompt} {next(counter)}", trace)
+
+            label = "on" if speculative else "off"
+            results[f"pdf_link_speculative_{label}"] = summarize(ameasure(one, ctx.repeats))
+            # Время до готовности контекста: без шума генерации LLM
+            results[f"pdf_link_time_to_context_{label}"] = summarize([
+                sum(s["duration_ms"] for s in trace.stages if s["stage"] in ("sanitize", "context")) / 1000
+                for trace in traces[1:]
+            ])
+    finally:
+        PDFLinkAgent._download_pdf = original_download
+    return results
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Список регрессий относительно базовой линии по медиане"""
+    regressions = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if not reference:
+            continue
+        limit = reference["p50_ms"] * (1 + tolerance)
+        if current["p50_ms"] > limit:
+            regressions.append(
+                f"{name}: p50 {current['p50_ms']:.2f} ms > {reference['p50_ms']:.2f} ms (+{tolerance:.0%})"
+            )
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="MindForce offline benchmarks")
+    parser.add_argument("--only", nargs="*", choices=sorted(BENCHMARKS), help="Run selected benchmarks")
+    parser.add_argument("--quick", action="store_true", help="Fewer repeats and smaller inputs")
+    parser.add_argument("--output", default=str(REPO_ROOT / "benchmarks" / "out" / "results.json"))
+    parser.add_argument("--baseline", default=str(REPO_ROOT / "benchmarks" / "baseline.json"))
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true", help="Save results as the new baseline")
+    parser.add_argument("--embedding-model", help="Real sentence-transformers model for the paraphrase fixture")
+    args = parser.parse_args(argv)
+    # Относительные пути считаются от каталога запуска, а не от workdir
+    output = Path(args.output).resolve()
+    baseline_path = Path(args.baseline).resolve()
+
+    workdir = Path(tempfile.mkdtemp(prefix="mindforce-bench-"))
+    os.symlink(REPO_ROOT / "templates", workdir / "templates")
+    os.chdir(workdir)
+
+    ctx = BenchContext(workdir, args.quick, args.embedding_model)
+    results: Dict[str, Any] = {}
+    for name in args.only or BENCHMARKS:
+        print(f"[bench] {name}", file=sys.stderr)
+        results.update(BENCHMARKS[name](ctx))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": args.quick
+        },
+        "results": results
+    }
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for name, stats in results.items():
+        print(f"{name:40s} p50={stats['p50_ms']:10.3f} ms  p95={stats['p95_ms']:10.3f} ms")
+
+    if args.update_baseline:
+        # При --only обновляются только прогнанные бенчмарки
+        if args.only and baseline_path.exists():
+            with open(baseline_path) as f:
+                previous = json.load(f)
+            if previous["meta"].get("quick") != args.quick:
+                print(f"Baseline {baseline_path} has quick={previous['meta'].get('quick')}; "
+                      f"refusing to merge a quick={args.quick} run", file=sys.stderr)
+                return 2
+            report["results"] = {**previous["results"], **results}
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        return 0
+
+    if not baseline_path.exists():
+        print(f"No baseline at {baseline_path}, comparison skipped", file=sys.stderr)
+        return 0
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline["meta"].get("quick") != args.quick:
+        # Число повторов и размеры входов различаются: сравнение бессмысленно
+        print(f"Baseline {baseline_path} has quick={baseline['meta'].get('quick')}, "
+              f"this run quick={args.quick}; comparison skipped", file=sys.stderr)
+        return 0
+    regressions = compare(results, baseline["results"], args.tolerance)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+"""Маленькие случайно инициализированные модели для офлайн-бенчмарков"""
+import hashlib
+import string
+import tempfile
+from pathlib import Path
+from typing import List, Union
+
+import numpy as np
+import torch
+from transformers import (BertConfig, BertForSequenceClassification,
+                          BertTokenizer, GPT2Config, GPT2LMHeadModel)
+
+from llm.phi_wrapper import PhiLLM
+from sanitizer.prompt_sanitizer import PromptSanitizer
+
+WORDS = (
+    "the a of and to in is it that for on with as by this be are from or an "
+    "paper result method model data code function return value question answer "
+    "document section table figure python class import print what does how why "
+    "conclusion summary analysis response context feedback rate quality"
+).split()
+
+def build_tokenizer() -> BertTokenizer:
+    """WordPiece-токенизатор на небольшом словаре"""
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+    vocab += list(string.ascii_lowercase + string.digits + string.punctuation)
+    vocab += ["##" + c for c in string.ascii_lowercase + string.digits]
+    vocab += [w for w in WORDS if w not in vocab]
+    vocab_file = Path(tempfile.mkdtemp()) / "vocab.txt"
+    vocab_file.write_text("\n".join(vocab))
+    return BertTokenizer(str(vocab_file))
+
+def build_llm(
+    tokenizer: BertTokenizer,
+    seed: int = 0,
+    n_layer: int = 2,
+    policy=None,
+    min_new_tokens: int = 32
+) -> PhiLLM:
+    """Случайная GPT-2; ``min_new_tokens`` не дает ей сразу выдать EOS,
+    чтобы бенчмарки действительно измеряли декодирование"""
+    torch.manual_seed(seed)
+    config = GPT2Config(
+        vocab_size=tokenizer.vocab_size,
+        n_positions=2048,
+        n_embd=64,
+        n_layer=n_layer,
+        n_head=2,
+        bos_token_id=tokenizer.cls_token_id,
+        eos_token_id=tokenizer.sep_token_id,
+        pad_token_id=tokenizer.pad_token_id
+    )
+    model = GPT2LMHeadModel(config).eval()
+    model.generation_config.pad_token_id = tokenizer.pad_token_id
+    model.generation_config.min_new_tokens = min_new_tokens
+    return PhiLLM(model_id=f"stub-gpt2-{n_layer}l-{seed}", tokenizer=tokenizer, model=model, policy=policy)
+
+def build_llm_pair(
+    tokenizer: BertTokenizer,
+    seed: int = 0,
+    target_layers: int = 12,
+    draft_layers: int = 1,
+    paired: bool = True,
+    n_embd: int = 512
+) -> PhiLLM:
+    """Основная модель с черновой для ассистированного декодирования.
+
+    В согласованной паре слои основной модели после первых
+    ``draft_layers`` не меняют остаточный поток (нулевые выходные
+    проекции), поэтому черновая модель из первых слоев предсказывает
+    те же токены за долю вычислений. Несогласованная черновая модель
+    инициализирована независимо и почти всегда ошибается.
+    """
+    torch.manual_seed(seed)
+    def gpt2(n_layer: int, tied: bool = True) -> GPT2LMHeadModel:
+        config = GPT2Config(
+            vocab_size=tokenizer.vocab_size,
+            n_positions=2048,
+            n_embd=n_embd,
+            n_layer=n_layer,
+            n_head=4,
+            tie_word_embeddings=tied,
+            bos_token_id=tokenizer.cls_token_id,
+            eos_token_id=tokenizer.sep_token_id,
+            pad_token_id=tokenizer.pad_token_id
+        )
+        model = GPT2LMHeadModel(config).eval()
+        model.generation_config.pad_token_id = tokenizer.pad_token_id
+        return model
+
+    target = gpt2(target_layers)
+    with torch.no_grad():
+        for block in target.transformer.h[draft_layers:]:
+            for proj in (block.attn.c_proj, block.mlp.c_proj):
+                proj.weight.zero_()
+                proj.bias.zero_()
+    if paired:
+        draft = gpt2(draft_layers)
+        draft.load_state_dict(target.state_dict(), strict=False)
+    else:
+        draft = gpt2(draft_layers, tied=False)
+    return PhiLLM(
+        model_id=f"stub-gpt2-{target_layers}l-{seed}-assisted",
+        tokenizer=tokenizer,
+        model=target,
+        draft_model=draft
+    )
+
+def build_sanitizer(
+    tokenizer: BertTokenizer,
+    seed: int = 0,
+    quantize: bool = False,
+    hidden_size: int = 32
+) -> PromptSanitizer:
+    torch.manual_seed(seed)
+    config = BertConfig(
+        vocab_size=tokenizer.vocab_size,
+        hidden_size=hidden_size,
+        num_hidden_layers=2,
+        num_attention_heads=2,
+        intermediate_size=2 * hidden_size,
+        max_position_embeddings=512,
+        num_labels=2
+    )
+    model = BertForSequenceClassification(config)
+    with torch.no_grad():
+        # Смещение в сторону "безопасного" класса, чтобы случайная
+        # модель не блокировала запросы бенчмарка
+        model.classifier.bias.copy_(torch.tensor([4.0, -4.0]))
+    return PromptSanitizer(tokenizer=tokenizer, model=model, quantize=quantize)
+
+def calibrate_sanitizer(sanitizer: PromptSanitizer, texts: List[str], threshold: float, spread: float = 2.0):
+    """Классификатор заглушки по главной компоненте pooled-выходов.
+
+    У случайного BERT выходы разных текстов почти совпадают, и все
+    оценки лежат в узком интервале. Проекция на направление наибольшего
+    разброса с логит-отклонением ``spread`` и медианой на пороге дает
+    оценки, которые распределены по обе стороны ``threshold``.
+    """
+    encoded = sanitizer.tokenizer(texts, return_tensors="pt", padding=True, truncation=True, max_length=512)
+    with torch.no_grad():
+        pooled = sanitizer.model.bert(**encoded).pooler_output
+        centered = pooled - pooled.mean(dim=0)
+        direction = torch.linalg.svd(centered, full_matrices=False).Vh[0]
+        projection = pooled @ direction
+        scale = spread / projection.std()
+        classifier = sanitizer.model.classifier
+        classifier.weight.zero_()
+        classifier.weight[1] = direction * scale
+        classifier.bias.zero_()
+        target = float(np.log(threshold / (1 - threshold)))
+        classifier.bias[1] = target - float((projection * scale).median())
+
+class StubEmbedder:
+    """Замена SentenceTransformer: детерминированные hashing-эмбеддинги"""
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in text.lower().split():
+            digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        return vector
+
+    def encode(
+        self,
+        texts: Union[str, List[str]],
+        convert_to_tensor: bool = False,
+        convert_to_numpy: bool = True,
+        **kwargs
+    ):
+        single = isinstance(texts, str)
+        batch = np.stack([self._embed(t) for t in ([texts] if single else texts)])
+        result = batch[0] if single else batch
+        if convert_to_tensor:
+            return torch.from_numpy(result)
+        return result
+
+class FakeContainer:
+    def __init__(self, output: bytes):
+        self._output = output
+
+    def wait(self, timeout=None):
+        return {"StatusCode": 0}
+
+    def logs(self):
+        return self._output
+
+    def remove(self, force=False):
+        pass
+
+class FakeContainers:
+    def run(self, image, command, **kwargs):
+        return FakeContainer(b"ok\n")
+
+class FakeDockerClient:
+    """Замена docker.DockerClient без демона"""
+    def __init__(self):
+        self.containers = FakeContainers()
+
+    def ping(self):
+        return True
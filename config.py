@@ -0,0 +1,81 @@
+# Модель эмбеддингов (агенты, SocietyMind, семантический кэш)
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Семантический кэш
+SEMANTIC_CACHE_MODEL = EMBEDDING_MODEL
+# Порог не проверен на настоящей модели: подбирается прогоном
+# python -m benchmarks.run --only semantic_cache --embedding-model all-MiniLM-L6-v2
+# (precision/recall на benchmarks/fixtures/paraphrases.jsonl)
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_DIR = "cache/semantic"
+SEMANTIC_CACHE_MAX_ENTRIES = 50000    # на один набор данных
+SEMANTIC_CACHE_MAX_INDEXES = 64       # индексов в памяти, остальные на диске
+SEMANTIC_CACHE_SAVE_INTERVAL = 60     # секунд между сбросами на диск
+
+# Санитайзер
+SANITIZER_MODEL_PATH = "bert-prompt-sanitizer"
+# int8 включать только после проверки согласия вердиктов на настоящей
+# модели: MINDFORCE_SANITIZER_MODEL=... python -m benchmarks.run --only sanitizer_quant
+SANITIZER_QUANTIZE = False
+SANITIZER_WINDOW_STRIDE = 384
+SANITIZER_MAX_BATCH = 32
+
+# Загрузки пользователей
+UPLOAD_DIR = "uploads"
+
+# Агенты: параметры песочницы и лимиты пулов по типам агентов. Запрос,
+# ждущий или работающий в пуле, не занимает слот SERVER_MAX_IN_FLIGHT;
+# при полной очереди пула сервер отвечает 503
+DOCKER_CONFIG = {}
+AGENT_POOLS = {
+    "pdf_link": {"max_concurrency": 2, "max_queue": 8},
+    "pdf_file": {"max_concurrency": 2, "max_queue": 8},
+    "code": {"max_concurrency": 4, "max_queue": 16},
+    "default": {"max_concurrency": 32, "max_queue": 128}
+}
+
+# Индекс отпечатков загруженных файлов
+FINGERPRINT_INDEX_PATH = "cache/fingerprints.json"
+FINGERPRINT_SAVE_INTERVAL = 30   # секунд между записями индекса на диск
+
+# Журналы
+REQUEST_LOG_PATH = "logs/request_log.jsonl"
+EVENT_LOG_PATH = "logs/events.jsonl"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+LOG_COMPRESS = True
+
+# Метрики
+METRICS_ENABLED = True
+METRICS_FILE = "logs/metrics.prom"
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = None
+
+# Сервер
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8080
+SERVER_WORKERS = 1
+SERVER_MAX_IN_FLIGHT = 8
+SERVER_MAX_QUEUE = 32
+SERVER_REQUEST_TIMEOUT = 120
+SERVER_DRAIN_TIMEOUT = 30
+SERVER_MAX_BODY = 1024 * 1024
+
+# Спекулятивная подготовка агентов параллельно с санитайзингом
+SPECULATIVE_AGENT_PREP = True
+
+# Ассистированное декодирование: черновая модель с тем же токенизатором,
+# что и основная (например, "microsoft/phi-1_5" для phi-2); None - выключено
+LLM_DRAFT_MODEL = None
+LLM_ASSIST_MIN_ACCEPTANCE = 0.3
+
+# Бюджеты токенов по ролям, обучаемые по длинам ответов, и стоп-последовательности;
+# False - фиксированные бюджеты и остановка только по EOS
+LLM_ADAPTIVE_GENERATION = True
+
+# Пакетный режим
+BATCH_CHUNK_SIZE = 256
+BATCH_LLM_BATCH_SIZE = 8
+BATCH_REFINE_CONCURRENCY = 8
+# Подготовленные PDF, переиспользуемые между порциями
+BATCH_DOCUMENT_CACHE = 32
@@ -0,0 +1,157 @@
+"""Ассистированное (спекулятивное) декодирование.
+
+Маленькая черновая модель с тем же токенизатором предлагает несколько
+токенов, основная модель проверяет их одним прямым проходом. Для каждой
+роли (critic, generator, finalizer, режимы PhiLLM) ведется доля
+принятых черновых токенов и ускорение относительно обычного
+декодирования; при низкой доле принятия роль переключается на обычное
+декодирование и периодически пробует ассистирование снова.
+"""
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from utils.metrics import metrics
+
+ACCEPTANCE = metrics.summary("llm_assist_acceptance_ratio", "Share of draft tokens accepted by the target model")
+SPEEDUP = metrics.gauge("llm_assist_speedup", "Assisted vs plain decoding speed per role")
+FALLBACKS = metrics.counter("llm_assist_fallbacks_total", "Roles switched to plain decoding")
+
+class ForwardCounter:
+    """Число прямых проходов основной и черновой модели в текущем потоке"""
+    def __init__(self):
+        self.target = 0
+        self.draft = 0
+
+class RoleStats:
+    def __init__(self, window: int):
+        self.acceptance = deque(maxlen=window)
+        self.assisted_calls = 0
+        self.plain_calls = 0
+        self.plain_since_fallback = 0
+        self.enabled = True
+        # Секунды на токен, экспоненциальное скользящее среднее
+        self.assisted_spt: Optional[float] = None
+        self.plain_spt: Optional[float] = None
+
+    @property
+    def acceptance_rate(self) -> Optional[float]:
+        if not self.acceptance:
+            return None
+        return sum(self.acceptance) / len(self.acceptance)
+
+    @property
+    def speedup(self) -> Optional[float]:
+        if not self.assisted_spt or not self.plain_spt:
+            return None
+        return self.plain_spt / self.assisted_spt
+
+class AssistedDecoding:
+    EWMA_ALPHA = 0.2
+
+    def __init__(
+        self,
+        target_model,
+        draft_model,
+        min_acceptance: float = 0.3,
+        window: int = 8,
+        min_calls: int = 3,
+        probe_interval: int = 50
+    ):
+        self.draft_model = draft_model
+        self.min_acceptance = min_acceptance
+        self.window = window
+        self.min_calls = min_calls
+        self.probe_interval = probe_interval
+        self._roles: Dict[str, RoleStats] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        # Хуки регистрируются один раз; считают только потоки,
+        # находящиеся внутри counting(), поэтому параллельные
+        # генерации не мешают друг другу
+        target_model.register_forward_hook(self._count_hook("target"))
+        draft_model.register_forward_hook(self._count_hook("draft"))
+
+    def _count_hook(self, kind: str):
+        def hook(module, args, output):
+            counter = getattr(self._local, "counter", None)
+            if counter is not None:
+                setattr(counter, kind, getattr(counter, kind) + 1)
+        return hook
+
+    @contextmanager
+    def counting(self):
+        counter = ForwardCounter()
+        self._local.counter = counter
+        try:
+            yield counter
+        finally:
+            self._local.counter = None
+
+    def _role(self, role: str) -> RoleStats:
+        stats = self._roles.get(role)
+        if stats is None:
+            stats = self._roles[role] = RoleStats(self.window)
+        return stats
+
+    def should_assist(self, role: str) -> bool:
+        with self._lock:
+            stats = self._role(role)
+            if stats.enabled:
+                # Изредка обычное декодирование - базовая линия для ускорения
+                return stats.plain_calls * self.probe_interval > stats.assisted_calls - self.min_calls
+            # Пробное ассистирование после probe_interval обычных вызовов
+            if stats.plain_since_fallback >= self.probe_interval:
+                stats.enabled = True
+                stats.acceptance.clear()
+                return True
+            return False
+
+    def record(self, role: str, assisted: bool, new_tokens: int, counter: ForwardCounter, seconds: float):
+        if new_tokens <= 0:
+            return
+        with self._lock:
+            stats = self._role(role)
+            spt = seconds / new_tokens
+            if assisted:
+                stats.assisted_calls += 1
+                stats.assisted_spt = self._ewma(stats.assisted_spt, spt)
+                # Каждый проход основной модели дает принятые черновые
+                # токены плюс один собственный
+                if counter.draft:
+                    rate = max(0, new_tokens - counter.target) / counter.draft
+                    stats.acceptance.append(rate)
+                    ACCEPTANCE.observe(rate, role=role)
+                if (
+                    len(stats.acceptance) >= self.min_calls
+                    and stats.acceptance_rate < self.min_acceptance
+                ):
+                    stats.enabled = False
+                    stats.plain_since_fallback = 0
+                    FALLBACKS.inc(role=role)
+            else:
+                stats.plain_calls += 1
+                stats.plain_since_fallback += 1
+                stats.plain_spt = self._ewma(stats.plain_spt, spt)
+
+            if stats.speedup is not None:
+                SPEEDUP.set(stats.speedup, role=role)
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        if current is None:
+            return value
+        return current + self.EWMA_ALPHA * (value - current)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                role: {
+                    "enabled": stats.enabled,
+                    "acceptance_rate": stats.acceptance_rate,
+                    "speedup": stats.speedup,
+                    "assisted_calls": stats.assisted_calls,
+                    "plain_calls": stats.plain_calls
+                }
+                for role, stats in self._roles.items()
+            }
@@ -1,28 +1,225 @@
 from transformers import AutoTokenizer, AutoModelForCausalLM
 import torch
+import asyncio
+import hashlib
 import os
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+import config
+from llm.assisted import AssistedDecoding
+from llm.policy import GenerationPolicy
+from utils.metrics import metrics
+
+PROMPT_TOKENS = metrics.counter("llm_prompt_tokens_total", "Prompt tokens fed to the LLM")
+GENERATED_TOKENS = metrics.counter("llm_generated_tokens_total", "Tokens generated by the LLM")
+TOKENS_PER_SECOND = metrics.summary("llm_tokens_per_second", "LLM decoding throughput")
+REQUEST_TOKENS = metrics.summary("request_generated_tokens", "Tokens generated per request")
+
+# Счетчик токенов текущего запроса; asyncio.to_thread копирует контекст,
+# поэтому генерации в потоках пишут в счетчик своего запроса
+_request_tokens: ContextVar = ContextVar("request_tokens", default=None)
 
 class PhiLLM:
-    def __init__(self, model_id="microsoft/phi-2"):
-        self.tokenizer = AutoTokenizer.from_pretrained(model_id)
-        self.model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float16).cuda()
+    MAX_PROMPT_TOKENS = 1024
+    TEMPLATES = {
+        "pdf": "pdf_instruction.txt",
+        "code": "code_instruction.txt",
+        "auto": "default_instruction.txt"
+    }
+
+    def __init__(
+        self,
+        model_id="microsoft/phi-2",
+        tokenizer=None,
+        model=None,
+        draft_model=None,
+        draft_model_id=config.LLM_DRAFT_MODEL,
+        policy=None
+    ):
+        self.policy = policy or GenerationPolicy(adaptive=config.LLM_ADAPTIVE_GENERATION)
+        self.version = f"{model_id}+{self.policy.version}"
+        if tokenizer is not None and model is not None:
+            self.tokenizer = tokenizer
+            self.model = model
+        else:
+            self.tokenizer = AutoTokenizer.from_pretrained(model_id)
+            self.model = AutoModelForCausalLM.from_pretrained(model_id, torch_dtype=torch.float16).cuda()
+
+        if draft_model is None and draft_model_id:
+            draft_model = AutoModelForCausalLM.from_pretrained(
+                draft_model_id,
+                torch_dtype=self.model.dtype
+            ).to(self.model.device)
+        self.assistant = None
+        if draft_model is not None:
+            self.assistant = AssistedDecoding(
+                self.model,
+                draft_model.eval(),
+                min_acceptance=config.LLM_ASSIST_MIN_ACCEPTANCE
+            )
+
+    @property
+    def device(self):
+        return self.model.device
 
     def _load_template(self, template_name):
         path = os.path.join("templates", template_name)
         with open(path) as f:
             return f.read()
 
-    def generate(self, prompt, context="", mode="auto"):
+    def template_version(self, mode="auto"):
+        """Хэш шаблона режима для инвалидации кэша стадий"""
+        template = self._load_template(self.TEMPLATES.get(mode, self.TEMPLATES["auto"]))
+        return hashlib.sha256(template.encode()).hexdigest()
+
+    def _fill_template(self, prompt, context="", mode="auto"):
         if mode == "pdf":
             template = self._load_template("pdf_instruction.txt")
-            filled = template.format(context=context, question=prompt)
+            filled = self._fit(template, "context", context, question=prompt)
         elif mode == "code":
             template = self._load_template("code_instruction.txt")
-            filled = template.format(code=prompt, question="What does this code do?")
+            filled = self._fit(template, "code", prompt, question="What does this code do?")
         else:
             template = self._load_template("default_instruction.txt")
-            filled = template.format(question=prompt)
+            filled = self._fit(template, "question", prompt)
+        return filled
+
+    def _fit(self, template, field, value, **fields):
+        """Подстановка с обрезкой длинного поля до его бюджета токенов.
+
+        Обрезка готового промпта справа отрезала бы вопрос и "Output:",
+        поэтому укорачивается только само поле (контекст, код).
+        """
+        fixed = len(self.tokenizer(template.format(**{field: ""}, **fields))["input_ids"])
+        budget = max(0, self.MAX_PROMPT_TOKENS - fixed)
+        ids = self.tokenizer(value, add_special_tokens=False)["input_ids"]
+        if len(ids) > budget:
+            value = self.tokenizer.decode(ids[:budget], skip_special_tokens=True)
+        return template.format(**{field: value}, **fields)
+
+    def generate(self, prompt, context="", mode="auto"):
+        filled = self._fill_template(prompt, context, mode)
+        inputs = self.tokenizer(
+            filled,
+            return_tensors="pt",
+            max_length=self.MAX_PROMPT_TOKENS,
+            truncation=True
+        ).to(self.model.device)
+        return self._decode(inputs, mode)
+
+    def generate_raw(self, prompt, role="generator", **generation_kwargs):
+        """Генерация по готовому промпту без шаблона режима"""
+        inputs = self.tokenizer(
+            prompt,
+            return_tensors="pt",
+            max_length=self.MAX_PROMPT_TOKENS,
+            truncation=True
+        ).to(self.model.device)
+        return self._decode(inputs, role, **generation_kwargs)
+
+    async def generate_raw_async(self, prompt, role="generator", **generation_kwargs):
+        return await asyncio.to_thread(self.generate_raw, prompt, role, **generation_kwargs)
+
+    def _decode(self, inputs, role, **generation_kwargs):
+        """Один вызов model.generate по политике роли; возвращает только новый текст"""
+        prompt_tokens = inputs["input_ids"].shape[1]
+        budget = generation_kwargs.setdefault("max_new_tokens", self.policy.budget(role))
+        criteria, stop = self.policy.stopping_criteria(role, self.tokenizer, prompt_tokens)
+        generation_kwargs["stopping_criteria"] = criteria
+
+        assisted = self.assistant is not None and self.assistant.should_assist(role)
+        if assisted:
+            generation_kwargs["assistant_model"] = self.assistant.draft_model
+        counting = self.assistant.counting() if self.assistant is not None else nullcontext()
+        with counting as counter:
+            start = time.perf_counter()
+            outputs = self.model.generate(**inputs, **generation_kwargs)
+            seconds = time.perf_counter() - start
+
+        new_tokens = outputs.shape[1] - prompt_tokens
+        self.record_generation(role, prompt_tokens, new_tokens, seconds)
+        self.policy.observe(role, new_tokens, budget, seconds, stop.reasons.get(0) if stop else None)
+        if self.assistant is not None:
+            self.assistant.record(role, assisted, new_tokens, counter, seconds)
+
+        text = self.tokenizer.decode(outputs[0, prompt_tokens:], skip_special_tokens=True)
+        return self.policy.trim(role, text)
+
+    def assist_stats(self):
+        """Доля принятия и ускорение ассистированного декодирования по ролям"""
+        return self.assistant.stats() if self.assistant is not None else {}
+
+    def generate_batch(self, prompts, contexts, mode="auto"):
+        """Генерация для нескольких запросов одного режима за один вызов"""
+        filled = [self._fill_template(p, c, mode) for p, c in zip(prompts, contexts)]
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        # Для декодера паддинг слева, чтобы генерация продолжала текст
+        padding_side = self.tokenizer.padding_side
+        self.tokenizer.padding_side = "left"
+        try:
+            inputs = self.tokenizer(
+                filled,
+                return_tensors="pt",
+                max_length=self.MAX_PROMPT_TOKENS,
+                truncation=True,
+                padding=True
+            ).to(self.model.device)
+        finally:
+            self.tokenizer.padding_side = padding_side
+
+        prompt_length = inputs["input_ids"].shape[1]
+        budget = self.policy.budget(mode)
+        criteria, stop = self.policy.stopping_criteria(mode, self.tokenizer, prompt_length)
+        start = time.perf_counter()
+        outputs = self.model.generate(
+            **inputs,
+            max_new_tokens=budget,
+            stopping_criteria=criteria,
+            pad_token_id=self.tokenizer.pad_token_id
+        )
+        seconds = time.perf_counter() - start
+
+        generated = outputs[:, prompt_length:]
+        lengths = (generated != self.tokenizer.pad_token_id).sum(dim=1).tolist()
+        self.record_generation(mode, int(inputs["attention_mask"].sum()), sum(lengths), seconds)
+        for row, length in enumerate(lengths):
+            self.policy.observe(mode, length, budget, seconds, stop.reasons.get(row) if stop else None)
+        return [
+            self.policy.trim(mode, self.tokenizer.decode(row, skip_special_tokens=True))
+            for row in generated
+        ]
+
+    async def generate_batch_async(self, prompts, contexts, mode="auto"):
+        return await asyncio.to_thread(self.generate_batch, prompts, contexts, mode)
+
+    @staticmethod
+    def record_generation(role, prompt_tokens, generated_tokens, seconds):
+        """Учет токенов и скорости декодирования"""
+        if not metrics.enabled:
+            return
+        tally = _request_tokens.get()
+        if tally is not None:
+            tally[0] += generated_tokens
+        PROMPT_TOKENS.inc(prompt_tokens, role=role)
+        GENERATED_TOKENS.inc(generated_tokens, role=role)
+        if seconds > 0:
+            TOKENS_PER_SECOND.observe(generated_tokens / seconds, role=role)
+
+    @staticmethod
+    @contextmanager
+    def count_request_tokens():
+        """Подсчет токенов, сгенерированных за время одного запроса"""
+        tally = [0]
+        token = _request_tokens.set(tally)
+        try:
+            yield tally
+        finally:
+            _request_tokens.reset(token)
+            if metrics.enabled:
+                REQUEST_TOKENS.observe(tally[0])
 
-        inputs = self.tokenizer(filled, return_tensors="pt").to(self.model.device)
-        outputs = self.model.generate(**inputs, max_new_tokens=300)
-        return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
+    async def generate_async(self, prompt, context="", mode="auto"):
+        return await asyncio.to_thread(self.generate, prompt, context, mode)
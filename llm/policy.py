@@ -0,0 +1,192 @@
+"""Политика генерации: бюджеты токенов и условия остановки по ролям.
+
+Бюджет роли обучается по распределению длин ответов: после
+``min_samples`` наблюдений он равен квантилю длины с запасом. Ответы,
+упершиеся в бюджет, не показывают истинную длину, поэтому при частых
+обрезаниях бюджет растет. Стоп-последовательности обрывают генерацию,
+когда модель начинает воспроизводить разделы шаблона, а для критика -
+как только выставлена оценка.
+"""
+import hashlib
+import math
+import re
+import threading
+from collections import deque
+from typing import Dict, Optional, Tuple
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList
+from utils.metrics import metrics
+
+GENERATION_TOKENS = metrics.summary("llm_generation_tokens", "New tokens per generate call")
+GENERATION_SECONDS = metrics.summary("llm_generation_seconds", "Latency of a generate call")
+STOPS = metrics.counter("llm_generation_stops_total", "Why decoding ended")
+BUDGET = metrics.gauge("llm_generation_budget_tokens", "Current max_new_tokens per role")
+
+class StopOnText(StoppingCriteria):
+    """Остановка по тексту хвоста сгенерированных токенов"""
+    TAIL_TOKENS = 24
+
+    def __init__(
+        self,
+        tokenizer,
+        prompt_length: int,
+        stop: Optional[re.Pattern] = None,
+        pattern: Optional[re.Pattern] = None
+    ):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop = stop
+        self.pattern = pattern
+        self.reasons: Dict[int, str] = {}
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+        for row in range(input_ids.shape[0]):
+            if row in self.reasons:
+                done[row] = True
+                continue
+            generated = input_ids[row, self.prompt_length:]
+            tail = self.tokenizer.decode(generated[-self.TAIL_TOKENS:], skip_special_tokens=True)
+            if self.stop is not None and self.stop.search(tail):
+                self.reasons[row] = "stop_sequence"
+            elif self.pattern is not None and tail.endswith("\n") and self.pattern.search(
+                self.tokenizer.decode(generated, skip_special_tokens=True)
+            ):
+                self.reasons[row] = "structure"
+            done[row] = row in self.reasons
+        return done
+
+class GenerationPolicy:
+    DEFAULT_BUDGETS = {
+        "critic": 500,
+        "generator": 500,
+        "finalizer": 500,
+        "pdf": 300,
+        "code": 300,
+        "auto": 300
+    }
+    # Шаблоны SocietyMind размечены заголовками [РАЗДЕЛ], шаблоны режимов -
+    # строками "Question:"/"Instruction:"; их появление в ответе значит,
+    # что модель начала повторять промпт. Заголовок - только прописные
+    # буквы, чтобы не обрывать ссылки [1], списки ["a"] и [x] в markdown
+    SECTION_HEADER = r"\n\[[A-Z][A-Z ]+\]"
+    STOP_SEQUENCES = {
+        "critic": re.compile(SECTION_HEADER),
+        "generator": re.compile(SECTION_HEADER),
+        "finalizer": re.compile(SECTION_HEADER),
+        "pdf": re.compile(r"\n(?:Question|Instruction|Input):"),
+        "code": re.compile(r"\n(?:Question|Instruction|Input \(Code\)):"),
+        "auto": re.compile(r"\n(?:Question|Instruction):")
+    }
+    # Критика завершена, когда дописана строка оценки ("Rating: 4/5 - ...",
+    # "5. Rating: 3 ..."). Упоминания "rate" в тексте и эхо инструкции
+    # "Rate 1-5" оценкой не считаются
+    STRUCTURE = {
+        "critic": re.compile(
+            r"(?im)^[ \t]*(?:\d+\.[ \t]*)?Rating[ \t]*[:=][ \t]*[1-5]"
+            r"(?![ \t]*[-–][ \t]*\d)(?:[ \t]*/[ \t]*5)?\b[^\n]*\S[^\n]*\n"
+        )
+    }
+
+    def __init__(
+        self,
+        adaptive: bool = True,
+        budgets: Optional[Dict[str, int]] = None,
+        quantile: float = 0.95,
+        headroom: float = 1.25,
+        min_samples: int = 20,
+        min_budget: int = 32,
+        truncation_tolerance: float = 0.1,
+        window: int = 256
+    ):
+        self.adaptive = adaptive
+        self.max_budgets = dict(self.DEFAULT_BUDGETS, **(budgets or {}))
+        self.quantile = quantile
+        self.headroom = headroom
+        self.min_samples = min_samples
+        self.min_budget = min_budget
+        self.truncation_tolerance = truncation_tolerance
+        self.window = window
+        self._budgets: Dict[str, int] = {}
+        self._lengths: Dict[str, deque] = {}
+        self._truncated: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> str:
+        """Версия условий остановки для ключей кэша"""
+        if not self.adaptive:
+            return "fixed"
+        digest = hashlib.sha256()
+        for role in sorted(self.STOP_SEQUENCES):
+            digest.update(f"{role}:{self.STOP_SEQUENCES[role].pattern}".encode())
+        for role in sorted(self.STRUCTURE):
+            digest.update(self.STRUCTURE[role].pattern.encode())
+        return digest.hexdigest()[:12]
+
+    def _max_budget(self, role: str) -> int:
+        return self.max_budgets.get(role, self.max_budgets["auto"])
+
+    def budget(self, role: str) -> int:
+        if not self.adaptive:
+            return self._max_budget(role)
+        with self._lock:
+            return self._budgets.get(role, self._max_budget(role))
+
+    def stopping_criteria(self, role: str, tokenizer, prompt_length: int) -> Tuple[StoppingCriteriaList, Optional[StopOnText]]:
+        if not self.adaptive:
+            return StoppingCriteriaList(), None
+        criterion = StopOnText(
+            tokenizer,
+            prompt_length,
+            self.STOP_SEQUENCES.get(role),
+            self.STRUCTURE.get(role)
+        )
+        return StoppingCriteriaList([criterion]), criterion
+
+    def trim(self, role: str, text: str) -> str:
+        """Обрезка ответа по первой стоп-последовательности"""
+        stop = self.STOP_SEQUENCES.get(role)
+        if not self.adaptive or stop is None:
+            return text
+        match = stop.search(text)
+        return text[:match.start()] if match else text
+
+    def observe(self, role: str, new_tokens: int, budget: int, seconds: float, reason: Optional[str] = None):
+        """Учет длины ответа и пересчет бюджета роли"""
+        truncated = reason is None and new_tokens >= budget
+        reason = reason or ("budget" if truncated else "eos")
+        STOPS.inc(role=role, reason=reason)
+        GENERATION_TOKENS.observe(new_tokens, role=role)
+        GENERATION_SECONDS.observe(seconds, role=role)
+        if not self.adaptive:
+            return
+
+        with self._lock:
+            lengths = self._lengths.setdefault(role, deque(maxlen=self.window))
+            flags = self._truncated.setdefault(role, deque(maxlen=self.window))
+            lengths.append(new_tokens)
+            flags.append(truncated)
+            if len(lengths) < self.min_samples:
+                return
+
+            current = self._budgets.get(role, self._max_budget(role))
+            ordered = sorted(lengths)
+            learned = math.ceil(ordered[min(int(self.quantile * len(ordered)), len(ordered) - 1)] * self.headroom)
+            if sum(flags) / len(flags) > self.truncation_tolerance:
+                # Длины обрезанных ответов занижены: расширяем бюджет
+                learned = max(learned, math.ceil(current * 1.5))
+            self._budgets[role] = min(self._max_budget(role), max(self.min_budget, learned))
+            BUDGET.set(self._budgets[role], role=role)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                role: {
+                    "budget": self._budgets.get(role, self._max_budget(role)),
+                    "samples": len(lengths),
+                    "mean_tokens": sum(lengths) / len(lengths),
+                    "truncated_share": sum(self._truncated[role]) / len(lengths)
+                }
+                for role, lengths in self._lengths.items() if lengths
+            }
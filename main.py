@@ -1,52 +1,188 @@
+import argparse
 import asyncio
-from typing import Optional
+import re
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+import config
+from agents.base import Agent
 from agents.selector import AgentSelector
-from .llm.phi_wrapper import PhiLLM
-from .society_mind.autogen_society import SocietyMind
-from .sanitizer.prompt_sanitizer import SanitizationPipeline
-from .utils.io import get_input_data, send_response, log_request
-from .utils.cache import check_cache, save_cache
-from .utils.logger import setup_logging, RequestLogger
+from agents.pdf_link_agent import PDFLinkAgent
+from agents.pdf_file_agent import PDFFileAgent
+from agents.code_exec_agent import CodeExecutionAgent
+from agents.speculation import AgentSpeculation
+from llm.phi_wrapper import PhiLLM
+from society_mind.autogen_society import SocietyMind
+from sanitizer.prompt_sanitizer import SanitizationPipeline
+from utils.io import get_input_data, send_response_to_user, log_request
+from utils.cache import CacheManager, DataHasher, SemanticCache
+from utils.stages import StageMemo, StageTrace
+from utils.logger import setup_logging, RequestLogger
+from utils.metrics import metrics
 from utils.exceptions import (SecurityException, ProcessingError, 
-                        NetworkError, ResourceLimitExceeded)
+                        NetworkError, ResourceLimitExceeded, AgentOverloaded)
 
 class AIOrchestrator:
-    def __init__(self):
+    def __init__(
+        self,
+        llm: Optional[PhiLLM] = None,
+        selector: Optional[AgentSelector] = None,
+        society: Optional[SocietyMind] = None,
+        cache_manager: Optional[CacheManager] = None,
+        memo: Optional[StageMemo] = None
+    ):
         setup_logging()
         self.logger = RequestLogger()
-        self.selector = AgentSelector()
-        self.llm = PhiLLM()
-        self.society = SocietyMind(self.llm)
+        self.llm = llm or PhiLLM()
+        # Одна модель эмбеддингов на агентов, SocietyMind и семантический кэш
+        self._embedding_model = None
+        self.selector = selector or AgentSelector({
+            "embedding_model": self.embedding_model,
+            "embedding_model_name": config.EMBEDDING_MODEL,
+            "upload_dir": config.UPLOAD_DIR,
+            "docker_config": config.DOCKER_CONFIG
+        })
+        self.society = society or SocietyMind(self.llm, similarity_model=self.embedding_model)
+        self.cache_manager = cache_manager or CacheManager(
+            self.llm,
+            SemanticCache(embedding_model=self.embedding_model)
+        )
+        self.memo = memo or StageMemo()
         self.cache_enabled = True
+        self.speculative = config.SPECULATIVE_AGENT_PREP
 
-    async def process_request(self, user_input: str) -> str:
+    async def process_request(
+        self,
+        user_input: str,
+        trace: Optional[StageTrace] = None
+    ) -> str:
+        with metrics.span("total"), PhiLLM.count_request_tokens():
+            return await self._process_request(user_input, trace)
+
+    async def _process_request(
+        self,
+        user_input: str,
+        trace: Optional[StageTrace] = None
+    ) -> str:
+        trace = trace if trace is not None else StageTrace()
+        speculation = None
+        pending_hash = None
         try:
+            # Подготовка PDF/кода стартует параллельно с санитайзингом;
+            # LLM и песочница вызываются только после его успешного прохождения
+            if self.speculative:
+                speculation = AgentSpeculation.start(self.selector, user_input)
+
             # Шаг 1: Санитайзинг ввода
-            clean_input = await SanitizationPipeline.process(user_input)
-            
-            # Шаг 2: Проверка кэша
-            if self.cache_enabled:
-                cached = check_cache(clean_input)
+            with metrics.span("sanitize"):
+                clean_input, sanitize_key = await self._stage_sanitize(user_input, trace)
+            if speculation:
+                speculation.mark_cleared()
+
+            # Шаг 2: Выбор агента; он же определяет, к каким данным
+            # относится запрос
+            if speculation and speculation.matches(clean_input):
+                agent = speculation.agent
+            else:
+                if speculation:
+                    await speculation.cancel("discarded")
+                    speculation = None
+                with metrics.span("select_agent"):
+                    agent = self.selector.select_agent(clean_input)
+            with metrics.span("data_hash"):
+                data_hash, pending_hash = await self._stage_data_hash(agent, clean_input)
+
+            # Шаг 3: Проверка кэша и выполнение агента
+            if self.cache_enabled and pending_hash is None:
+                with metrics.span("cache_lookup"):
+                    cached = await self.cache_manager.lookup(clean_input, "", data_hash)
                 if cached:
                     self.logger.log("CACHE_HIT", {"input": clean_input})
                     return cached
 
-            # Шаг 3: Выбор и выполнение агента
-            agent = self.selector.select_agent(clean_input)
-            context = await agent.execute(clean_input)
+            if pending_hash is not None:
+                # Новый файл: ни ответов, ни стадий по нему еще нет, поэтому
+                # полный хэш считается параллельно с агентом
+                start = time.perf_counter()
+                with metrics.span("context"):
+                    context, data_hash = await asyncio.gather(
+                        self._execute_agent(agent, clean_input, speculation),
+                        pending_hash
+                    )
+                context_key = self.memo.stage_key(
+                    "context",
+                    version=agent.version,
+                    inputs=[clean_input, data_hash],
+                    upstream=[sanitize_key]
+                )
+                self.memo.store("context", context_key, context, trace, time.perf_counter() - start)
+            elif data_hash is None:
+                # Данные запроса не установлены: контекст не мемоизируется,
+                # а последующие стадии привязываются к его содержимому
+                with metrics.span("context"):
+                    context = await self._execute_agent(agent, clean_input, speculation)
+                context_key = self.memo.stage_key(
+                    "context",
+                    version=agent.version,
+                    inputs=[clean_input, DataHasher.hash_content(context.encode())],
+                    upstream=[sanitize_key]
+                )
+            else:
+                context_key = self.memo.stage_key(
+                    "context",
+                    version=agent.version,
+                    inputs=[clean_input, data_hash],
+                    upstream=[sanitize_key]
+                )
+                with metrics.span("context"):
+                    context = await self.memo.run(
+                        "context", context_key,
+                        lambda: self._execute_agent(agent, clean_input, speculation),
+                        trace
+                    )
             
             # Шаг 4: Генерация ответа
-            raw_response = await self.llm.generate_async(clean_input, context)
+            mode = self._get_mode(agent)
+            generate_key = self.memo.stage_key(
+                "generate",
+                version=f"{self.llm.version}-{self.llm.template_version(mode)}",
+                inputs=[clean_input, mode],
+                upstream=[context_key]
+            )
+            with metrics.span("generate"):
+                raw_response = await self.memo.run(
+                    "generate", generate_key,
+                    lambda: self.llm.generate_async(clean_input, context, mode),
+                    trace
+                )
             
             # Шаг 5: Обсуждение в SocietyMind
-            final_response = await self.society.refine(
-                prompt=clean_input,
-                context=context,
-                initial_response=raw_response
+            refine_key = self.memo.stage_key(
+                "refine",
+                version=self.society.version,
+                inputs=[clean_input],
+                upstream=[context_key, generate_key]
             )
+            with metrics.span("refine"):
+                final_response = await self.memo.run(
+                    "refine", refine_key,
+                    lambda: self.society.refine_response(
+                        query=clean_input,
+                        context=context,
+                        initial_response=raw_response
+                    ),
+                    trace
+                )
 
             # Шаг 6: Сохранение и возврат результата
-            save_cache(clean_input, final_response)
+            if self.cache_enabled:
+                with metrics.span("cache_save"):
+                    await self.cache_manager.save_response(
+                        prompt=clean_input,
+                        context="",
+                        response=final_response,
+                        data_hash=data_hash
+                    )
             return final_response
 
         except SecurityException as e:
@@ -54,8 +190,17 @@ class AIOrchestrator:
                 "input": user_input,
                 "reason": str(e)
             })
+            trace.blocked = str(e)
             return "Request blocked for security reasons"
             
+        except AgentOverloaded as e:
+            self.logger.log("PROCESSING_ERROR", {
+                "input": user_input,
+                "error": str(e)
+            })
+            trace.rejected = str(e)
+            return "Service is busy, please retry"
+
         except ProcessingError as e:
             self.logger.log("PROCESSING_ERROR", {
                 "input": user_input,
@@ -68,20 +213,142 @@ class AIOrchestrator:
                 "input": user_input,
                 "error": str(e)
             })
+            trace.failed = str(e)
             return "Internal server error"
 
         finally:
+            if pending_hash is not None and not pending_hash.done():
+                pending_hash.cancel()
+            if speculation:
+                await speculation.cancel()
+            self.logger.log("STAGE_TRACE", trace.to_dict())
             log_request(user_input, final_response if 'final_response' in locals() else None)
 
+    async def _execute_agent(
+        self,
+        agent: Agent,
+        clean_input: str,
+        speculation: Optional[AgentSpeculation]
+    ) -> str:
+        prepared = await speculation.result() if speculation else None
+        return await self.selector.dispatch(
+            agent,
+            lambda: agent.execute(clean_input, prepared)
+        )
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            self._embedding_model = SentenceTransformer(config.EMBEDDING_MODEL)
+        return self._embedding_model
+
+    async def _stage_sanitize(
+        self,
+        user_input: str,
+        trace: StageTrace
+    ) -> Tuple[str, str]:
+        """Санитайзинг с мемоизацией вердикта для одинакового текста.
+
+        Запоминаются только пропущенные запросы: блокировка всегда
+        перепроверяется, чтобы сбой модели не закрепился в кэше.
+        """
+        async def compute():
+            return await SanitizationPipeline.process(user_input)
+
+        key = self.memo.stage_key(
+            "sanitize",
+            version=await SanitizationPipeline.version(),
+            inputs=[user_input]
+        )
+        clean_input = await self.memo.run("sanitize", key, compute, trace)
+        return clean_input, key
+
+    async def _stage_data_hash(
+        self,
+        agent: Agent,
+        clean_input: str
+    ) -> Tuple[Optional[str], Optional[asyncio.Task]]:
+        """Хэш данных, к которым относится запрос.
+
+        None - область данных установить не удалось: семантический
+        кэш для такого запроса не используется. Для загрузки, чей
+        частичный отпечаток (размер, начало и конец) еще не встречался,
+        записей в кэше быть не может: вместо хэша возвращается задача,
+        которая считает его параллельно с агентом. Ложное "новый" после
+        вытеснения отпечатка стоит только лишнего пересчета.
+        """
+        match = re.search(r"<uploaded_file>(.+?)</uploaded_file>", clean_input)
+        if match:
+            file_path = await asyncio.to_thread(self._upload_path, match.group(1))
+            if file_path is None:
+                return None, None
+            # Файлы читаются вне цикла событий
+            if not await asyncio.to_thread(DataHasher.may_be_known, file_path):
+                return None, asyncio.ensure_future(asyncio.to_thread(DataHasher.hash_file, file_path))
+            return await asyncio.to_thread(DataHasher.hash_file, file_path), None
+        if isinstance(agent, PDFLinkAgent):
+            try:
+                url = agent._extract_url(clean_input)
+            except ProcessingError:
+                return None, None
+            return DataHasher.hash_content(f"url:{url}".encode()), None
+        if isinstance(agent, CodeExecutionAgent):
+            return DataHasher.hash_code(clean_input), None
+        return "no_data", None
+
+    @staticmethod
+    def _upload_path(name: str) -> Optional[Path]:
+        """Загруженный файл, который можно хэшировать.
+
+        Хэш считается до проверки агентом, поэтому здесь отсекаются
+        выход за UPLOAD_DIR, устройства и FIFO, а также файлы сверх
+        лимита размера: их агент все равно отклонит.
+        """
+        upload_dir = Path(config.UPLOAD_DIR).resolve()
+        file_path = (upload_dir / name).resolve()
+        if not file_path.is_relative_to(upload_dir) or not file_path.is_file():
+            return None
+        if file_path.stat().st_size > PDFFileAgent.MAX_FILE_SIZE:
+            return None
+        return file_path
+
+    @staticmethod
+    def _get_mode(agent: Agent) -> str:
+        if isinstance(agent, (PDFLinkAgent, PDFFileAgent)):
+            return "pdf"
+        if isinstance(agent, CodeExecutionAgent):
+            return "code"
+        return "auto"
+
 async def main_flow():
     orchestrator = AIOrchestrator()
+    if config.METRICS_PORT:
+        await metrics.start_http_server(config.METRICS_HOST, config.METRICS_PORT)
     while True:
         try:
-            user_input = get_input_data()
+            # input() блокирует поток, а не цикл событий: /metrics отвечает
+            # и пока CLI ждет ввода
+            user_input = await asyncio.to_thread(get_input_data)
             response = await orchestrator.process_request(user_input)
-            send_response(response)
+            send_response_to_user(response)
+            if config.METRICS_FILE:
+                metrics.write_prometheus(config.METRICS_FILE)
         except KeyboardInterrupt:
             break
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="MindForce assistant")
+    parser.add_argument("--serve", action="store_true", help="Run the HTTP server instead of the stdin loop")
+    parser.add_argument("--host", default=config.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=config.SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=config.SERVER_WORKERS)
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    asyncio.run(main_flow())
\ No newline at end of file
+    args = parse_args()
+    if args.serve:
+        from server import serve
+        serve(host=args.host, port=args.port, workers=args.workers)
+    else:
+        asyncio.run(main_flow())
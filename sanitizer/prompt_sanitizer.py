@@ -1,11 +1,29 @@
 import re
+import asyncio
+import hashlib
 import torch
 from transformers import BertTokenizer, BertForSequenceClassification
-from typing import Optional
+from typing import List, Optional
+import config
 from utils.exceptions import InjectionAttemptError, SecurityException
 
 class PromptSanitizer:
-    def __init__(self, model_path: str = "bert-prompt-sanitizer"):
+    MAX_LENGTH = 512
+    THRESHOLD = 0.85
+    LENGTH_BUCKETS = (32, 64, 128, 256, 512)
+
+    def __init__(
+        self,
+        model_path: str = config.SANITIZER_MODEL_PATH,
+        tokenizer=None,
+        model=None,
+        quantize: bool = config.SANITIZER_QUANTIZE,
+        window_stride: int = config.SANITIZER_WINDOW_STRIDE,
+        max_batch_size: int = config.SANITIZER_MAX_BATCH
+    ):
+        self.model_path = model_path
+        self.window_stride = window_stride
+        self.max_batch_size = max_batch_size
         self.patterns = [
             (r'(?i)(delete|drop|truncate)', "SQL injection"),
             (r'<script.*?>', "HTML injection"),
@@ -15,17 +33,70 @@ class PromptSanitizer:
             (r'/etc/passwd', "Sensitive file access")
         ]
         
-        try:
-            self.tokenizer = BertTokenizer.from_pretrained(model_path)
-            self.model = BertForSequenceClassification.from_pretrained(model_path).eval()
-        except Exception as e:
-            raise RuntimeError(f"Failed to load security model: {str(e)}")
+        if tokenizer is not None and model is not None:
+            self.tokenizer = tokenizer
+            self.model = model.eval()
+        else:
+            try:
+                self.tokenizer = BertTokenizer.from_pretrained(model_path)
+                self.model = BertForSequenceClassification.from_pretrained(model_path).eval()
+            except Exception as e:
+                raise RuntimeError(f"Failed to load security model: {str(e)}")
+
+        self.quantized = False
+        if quantize:
+            self.model = self._quantize(self.model)
+
+    @property
+    def version(self) -> str:
+        """Версия вердиктов для ключей кэша: модель, правила и схема оценки"""
+        digest = hashlib.sha256(repr((
+            self.model_path,
+            self.quantized,
+            self.window_stride,
+            self.MAX_LENGTH,
+            self.THRESHOLD,
+            self.patterns
+        )).encode())
+        return digest.hexdigest()[:12]
+
+    def _quantize(self, model):
+        """Динамическая int8-квантизация линейных слоев (только CPU)"""
+        if next(model.parameters()).device.type != "cpu":
+            return model
+        self.quantized = True
+        return torch.ao.quantization.quantize_dynamic(
+            model, {torch.nn.Linear}, dtype=torch.qint8
+        )
 
     def sanitize(self, prompt: str) -> str:
         self._check_patterns(prompt)
         self._check_ml(prompt)
         return prompt
 
+    def check_many(self, prompts: List[str]) -> List[Optional[str]]:
+        """Пакетная проверка: для каждого промпта None или причина блокировки"""
+        verdicts: List[Optional[str]] = [None] * len(prompts)
+        pending = []
+        for i, prompt in enumerate(prompts):
+            try:
+                self._check_patterns(prompt)
+                pending.append(i)
+            except SecurityException as e:
+                verdicts[i] = str(e)
+
+        try:
+            scores = self.score_many([prompts[i] for i in pending])
+        except Exception as e:
+            for i in pending:
+                verdicts[i] = f"Security check failed: {str(e)}"
+            return verdicts
+
+        for i, score in zip(pending, scores):
+            if score > self.THRESHOLD:
+                verdicts[i] = f"Security check failed: ML model detected malicious intent ({score:.2f})"
+        return verdicts
+
     def _check_patterns(self, text: str):
         for pattern, description in self.patterns:
             if re.search(pattern, text):
@@ -33,28 +104,117 @@ class PromptSanitizer:
 
     def _check_ml(self, text: str):
         try:
-            inputs = self.tokenizer(
-                text,
-                return_tensors="pt",
-                max_length=512,
-                truncation=True
-            )
-            
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-            
-            probs = torch.softmax(outputs.logits, dim=1)
-            if probs[0][1].item() > 0.85:
-                raise SecurityException("ML model detected malicious intent")
-                
+            score = self.score(text)
         except Exception as e:
             raise SecurityException(f"Security check failed: {str(e)}")
 
+        if score > self.THRESHOLD:
+            raise SecurityException(
+                f"Security check failed: ML model detected malicious intent ({score:.2f})"
+            )
+
+    def score(self, text: str) -> float:
+        """Вероятность вредоносности: максимум по окнам всего текста"""
+        return self.score_many([text])[0]
+
+    def score_many(self, texts: List[str]) -> List[float]:
+        """Оценка нескольких текстов.
+
+        Каждый текст режется на перекрывающиеся окна по 512 токенов,
+        окна группируются по длине, чтобы минимизировать паддинг, и
+        прогоняются пакетами. Итог текста - максимум по его окнам.
+        """
+        windows = []
+        for owner, text in enumerate(texts):
+            windows.extend((owner, window) for window in self._windows(text))
+
+        scores = [0.0] * len(texts)
+        for batch in self._buckets(windows):
+            for (owner, _), prob in zip(batch, self._forward([w for _, w in batch])):
+                scores[owner] = max(scores[owner], prob)
+        return scores
+
+    def _windows(self, text: str) -> List[List[int]]:
+        """Перекрывающиеся окна токенов с [CLS] и [SEP]"""
+        ids = self.tokenizer(
+            text,
+            add_special_tokens=False,
+            return_attention_mask=False,
+            verbose=False
+        )["input_ids"]
+        size = self.MAX_LENGTH - 2
+        starts = list(range(0, max(len(ids) - size, 0) + 1, self.window_stride))
+        if starts[-1] + size < len(ids):
+            # Последнее окно выравнивается по концу текста, чтобы все
+            # окна длинного текста имели одинаковую длину
+            starts.append(len(ids) - size)
+
+        cls_id, sep_id = self.tokenizer.cls_token_id, self.tokenizer.sep_token_id
+        return [[cls_id] + ids[start:start + size] + [sep_id] for start in starts]
+
+    def _buckets(self, windows):
+        """Пакеты окон близкой длины"""
+        def bucket_of(item):
+            length = len(item[1])
+            return next(b for b in self.LENGTH_BUCKETS if length <= b)
+
+        ordered = sorted(windows, key=lambda item: len(item[1]))
+        batch, current = [], None
+        for item in ordered:
+            bucket = bucket_of(item)
+            if batch and (bucket != current or len(batch) >= self.max_batch_size):
+                yield batch
+                batch = []
+            batch.append(item)
+            current = bucket
+        if batch:
+            yield batch
+
+    def _forward(self, windows: List[List[int]]) -> List[float]:
+        length = max(len(w) for w in windows)
+        pad_id = self.tokenizer.pad_token_id
+        input_ids = torch.full((len(windows), length), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(windows), length), dtype=torch.long)
+        for i, window in enumerate(windows):
+            input_ids[i, :len(window)] = torch.tensor(window)
+            attention_mask[i, :len(window)] = 1
+
+        device = next(self.model.parameters()).device
+        with torch.inference_mode():
+            logits = self.model(
+                input_ids=input_ids.to(device),
+                attention_mask=attention_mask.to(device)
+            ).logits
+        return torch.softmax(logits, dim=1)[:, 1].tolist()
+
 class SanitizationPipeline:
-    @staticmethod
-    async def process(prompt: str) -> str:
+    _sanitizer: Optional[PromptSanitizer] = None
+
+    @classmethod
+    def configure(cls, sanitizer: PromptSanitizer):
+        """Подмена экземпляра санитайзера (тесты, бенчмарки)"""
+        cls._sanitizer = sanitizer
+
+    @classmethod
+    def get_sanitizer(cls) -> PromptSanitizer:
+        # Модель загружается один раз на процесс, а не на каждый запрос
+        if cls._sanitizer is None:
+            cls._sanitizer = PromptSanitizer()
+        return cls._sanitizer
+
+    @classmethod
+    async def version(cls) -> str:
+        try:
+            sanitizer = cls._sanitizer or await asyncio.to_thread(cls.get_sanitizer)
+        except Exception as e:
+            raise SecurityException(str(e))
+        return sanitizer.version
+
+    @classmethod
+    async def process(cls, prompt: str) -> str:
         try:
-            sanitizer = PromptSanitizer()
-            return sanitizer.sanitize(prompt)
+            # BERT считается в потоке, чтобы не блокировать event loop
+            # и давать спекулятивной подготовке агента идти параллельно
+            return await asyncio.to_thread(cls.get_sanitizer().sanitize, prompt)
         except Exception as e:
             raise SecurityException(str(e))
\ No newline at end of file
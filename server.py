@@ -0,0 +1,313 @@
+import asyncio
+import multiprocessing
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+from aiohttp import web
+import config
+from agents.pool import outer_slot
+from utils.metrics import metrics
+from utils.stages import StageTrace
+
+IN_FLIGHT = metrics.gauge("server_in_flight", "Requests being processed")
+QUEUED = metrics.gauge("server_queued", "Requests waiting for a slot")
+RESPONSES = metrics.counter("server_responses_total", "Responses by HTTP status")
+ABANDONED = metrics.gauge("server_abandoned_threads", "Worker threads still running for timed-out requests")
+
+# Потоковые задачи текущего запроса (asyncio.to_thread и run_in_executor)
+_request_threads: ContextVar = ContextVar("request_threads", default=None)
+
+class TrackingExecutor(ThreadPoolExecutor):
+    """Исполнитель по умолчанию, запоминающий потоки каждого запроса.
+
+    Отмена корутины не останавливает уже запущенный поток (например,
+    генерацию LLM), поэтому сервер держит слот запроса, пока его
+    потоки не завершатся.
+    """
+    def submit(self, fn, *args, **kwargs):
+        future = super().submit(fn, *args, **kwargs)
+        threads = _request_threads.get()
+        if threads is not None:
+            threads.add(future)
+            future.add_done_callback(threads.discard)
+        return future
+
+class RequestSlot:
+    """Слот сервера, занятый одним запросом.
+
+    Пока запрос ждет или работает в пуле агента, слот отдается
+    другим запросам (запрос снова считается ожидающим), иначе
+    всплеск медленных PDF занял бы все слоты сервера.
+    """
+    def __init__(self, server: "OrchestratorServer"):
+        self.server = server
+        self.held = False
+        self.closed = False
+        self._yields = 0
+
+    async def acquire(self):
+        await self.server._slots.acquire()
+        self.held = True
+        self.server._track(queued=-1, in_flight=1)
+
+    @asynccontextmanager
+    async def yielded(self):
+        self._yields += 1
+        if self._yields == 1 and self.held:
+            self.held = False
+            self.server._slots.release()
+            self.server._track(queued=1, in_flight=-1)
+        try:
+            yield
+        except BaseException:
+            # При ошибке или отмене (таймаут) слот не ждем заново:
+            # счетчик ожидающих поправит release()
+            self._yields -= 1
+            raise
+        self._yields -= 1
+        if self._yields == 0 and not self.held and not self.closed:
+            await self.acquire()
+
+    def release(self):
+        """Окончательное освобождение по завершении запроса"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.held:
+            self.held = False
+            self.server._slots.release()
+            self.server._track(in_flight=-1)
+        else:
+            self.server._track(queued=-1)
+
+class OrchestratorServer:
+    """HTTP-сервер над общим AIOrchestrator.
+
+    Одновременно обрабатывается не больше ``max_in_flight`` запросов,
+    еще ``max_queue`` ждут своей очереди; остальные сразу получают 429.
+    При остановке новые запросы отклоняются с 503, а начатые
+    дорабатываются в течение ``drain_timeout``.
+    """
+    def __init__(
+        self,
+        orchestrator,
+        max_in_flight: int = config.SERVER_MAX_IN_FLIGHT,
+        max_queue: int = config.SERVER_MAX_QUEUE,
+        request_timeout: float = config.SERVER_REQUEST_TIMEOUT,
+        drain_timeout: float = config.SERVER_DRAIN_TIMEOUT
+    ):
+        self.orchestrator = orchestrator
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.request_timeout = request_timeout
+        self.drain_timeout = drain_timeout
+        self.in_flight = 0
+        self.queued = 0
+        self.draining = False
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._abandoned = set()
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=config.SERVER_MAX_BODY)
+        app.router.add_post("/ask", self.handle_ask)
+        app.router.add_get("/health", self.handle_health)
+        app.router.add_get("/metrics", metrics.handle_metrics)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        return app
+
+    async def on_startup(self, app: web.Application):
+        asyncio.get_running_loop().set_default_executor(TrackingExecutor())
+
+    async def handle_ask(self, request: web.Request) -> web.Response:
+        if self.draining:
+            return self._reply(503, {"error": "Server is shutting down"})
+        if self.in_flight + self.queued >= self.max_in_flight + self.max_queue:
+            return self._reply(429, {"error": "Server is saturated"}, headers={"Retry-After": "1"})
+
+        # Место в очереди резервируется до первого await, иначе
+        # одновременно пришедшие запросы обойдут проверку
+        self._track(queued=1)
+        slot = {"taken": False}
+        try:
+            try:
+                payload = await request.json()
+                user_input = payload["input"]
+            except (ValueError, KeyError, TypeError):
+                return self._reply(400, {"error": "Expected JSON body with 'input'"})
+            if not isinstance(user_input, str):
+                return self._reply(400, {"error": "'input' must be a string"})
+
+            trace = StageTrace()
+            response = await asyncio.wait_for(
+                self._process(user_input, trace, slot),
+                timeout=self.request_timeout
+            )
+            if trace.rejected:
+                # Очередь пула агента переполнена: клиент может повторить позже
+                return self._reply(
+                    503,
+                    {"error": f"Agent is busy: {trace.rejected}"},
+                    headers={"Retry-After": "1"}
+                )
+            if trace.blocked:
+                return self._reply(403, {"error": response})
+            if trace.failed:
+                return self._reply(500, {"error": response})
+            return self._reply(200, {"response": response, "trace": trace.stages})
+        except asyncio.TimeoutError:
+            return self._reply(504, {"error": "Request timed out"})
+        finally:
+            if not slot["taken"]:
+                self._track(queued=-1)
+
+    async def _process(self, user_input: str, trace: StageTrace, slot: dict) -> str:
+        lease = RequestSlot(self)
+        await lease.acquire()
+        slot["taken"] = True
+        threads = set()
+        token = _request_threads.set(threads)
+        lease_token = outer_slot.set(lease)
+        try:
+            return await self.orchestrator.process_request(user_input, trace)
+        finally:
+            outer_slot.reset(lease_token)
+            _request_threads.reset(token)
+            # Колбэки завершения удаляют future из множества в рабочих
+            # потоках, поэтому перебирается копия
+            pending = [future for future in threads.copy() if not future.done()]
+            if pending:
+                # Таймаут отменил корутину, но потоки еще работают:
+                # слот освобождается только после их завершения
+                task = asyncio.get_running_loop().create_task(self._release_after(pending, lease))
+                self._abandoned.add(task)
+                task.add_done_callback(self._abandoned.discard)
+            else:
+                lease.release()
+
+    async def _release_after(self, pending: list, lease: RequestSlot):
+        ABANDONED.inc(len(pending))
+        try:
+            await asyncio.wait([asyncio.wrap_future(future) for future in pending])
+        finally:
+            ABANDONED.dec(len(pending))
+            lease.release()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "draining" if self.draining else "ok",
+            "in_flight": self.in_flight,
+            "queued": self.queued
+        })
+
+    async def on_shutdown(self, app: web.Application):
+        """Остановка приема запросов и ожидание начатых"""
+        self.draining = True
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _track(self, queued: int = 0, in_flight: int = 0):
+        self.queued += queued
+        self.in_flight += in_flight
+        QUEUED.set(self.queued)
+        IN_FLIGHT.set(self.in_flight)
+        if self.queued + self.in_flight == 0:
+            self._idle.set()
+        else:
+            self._idle.clear()
+
+    @staticmethod
+    def _reply(status: int, body: dict, headers: Optional[dict] = None) -> web.Response:
+        RESPONSES.inc(status=status)
+        return web.json_response(body, status=status, headers=headers)
+
+def worker_path(path: str, worker_id: int) -> str:
+    """logs/events.jsonl -> logs/events.worker1.jsonl"""
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.worker{worker_id}{path.suffix}"))
+
+def run_worker(
+    host: str,
+    port: int,
+    reuse_port: bool = False,
+    worker_id: Optional[int] = None,
+    **server_options
+):
+    """Один процесс-воркер со своим AIOrchestrator.
+
+    У каждого воркера из нескольких свои JSONL-логи (ротацию файла
+    делает только его владелец) и метка ``worker`` у метрик; при
+    заданном METRICS_PORT воркер отдает /metrics на METRICS_PORT + id.
+    """
+    if worker_id is not None:
+        config.REQUEST_LOG_PATH = worker_path(config.REQUEST_LOG_PATH, worker_id)
+        config.EVENT_LOG_PATH = worker_path(config.EVENT_LOG_PATH, worker_id)
+        metrics.set_constant_labels(worker=worker_id)
+
+    from main import AIOrchestrator
+
+    server = OrchestratorServer(AIOrchestrator(), **server_options)
+    app = server.build_app()
+    if config.METRICS_PORT:
+        async def start_metrics(app):
+            app["metrics_runner"] = await metrics.start_http_server(
+                config.METRICS_HOST,
+                config.METRICS_PORT + (worker_id or 0)
+            )
+
+        async def stop_metrics(app):
+            await app["metrics_runner"].cleanup()
+
+        app.on_startup.append(start_metrics)
+        app.on_cleanup.append(stop_metrics)
+
+    web.run_app(
+        app,
+        host=host,
+        port=port,
+        reuse_port=reuse_port,
+        shutdown_timeout=server.drain_timeout,
+        print=None
+    )
+
+def serve(
+    host: str = config.SERVER_HOST,
+    port: int = config.SERVER_PORT,
+    workers: int = config.SERVER_WORKERS,
+    **server_options
+):
+    """Запуск сервера; при workers > 1 процессы делят порт (SO_REUSEPORT)
+    и общие дисковые кэши"""
+    if workers <= 1:
+        run_worker(host, port, **server_options)
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(
+            target=run_worker,
+            args=(host, port, True, i),
+            kwargs=server_options,
+            name=f"mindforce-worker-{i}"
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.join()
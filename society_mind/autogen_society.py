@@ -1,11 +1,14 @@
 import os
-import asyncio
+import hashlib
 import torch
 import re
 from typing import Optional, Tuple
 from sentence_transformers import SentenceTransformer, util
 from llm.phi_wrapper import PhiLLM
 from utils.exceptions import QualityThresholdReached
+from utils.metrics import metrics
+
+ROUNDS = metrics.counter("society_rounds_total", "SocietyMind refinement rounds")
 
 class SocietyMind:
     def __init__(
@@ -13,13 +16,14 @@ class SocietyMind:
         model: PhiLLM,
         max_rounds: int = 3,
         similarity_threshold: float = 0.85,
-        quality_threshold: float = 0.7
+        quality_threshold: float = 0.7,
+        similarity_model: Optional[SentenceTransformer] = None
     ):
         self.model = model
         self.max_rounds = max_rounds
         self.similarity_threshold = similarity_threshold
         self.quality_threshold = quality_threshold
-        self.similarity_model = SentenceTransformer('all-MiniLM-L6-v2')
+        self.similarity_model = similarity_model or SentenceTransformer('all-MiniLM-L6-v2')
         
         self.templates = {
             'generator': self._load_template("generator_instruction.txt"),
@@ -27,6 +31,17 @@ class SocietyMind:
             'finalizer': self._load_template("finalizer_instruction.txt")
         }
 
+    @property
+    def version(self) -> str:
+        """Версия стадии доработки: модель, шаблоны и параметры"""
+        digest = hashlib.sha256(self.model.version.encode())
+        for name in sorted(self.templates):
+            digest.update(self.templates[name].encode())
+        digest.update(
+            f"{self.max_rounds}-{self.similarity_threshold}-{self.quality_threshold}".encode()
+        )
+        return digest.hexdigest()
+
     async def refine_response(
         self,
         query: str,
@@ -38,30 +53,36 @@ class SocietyMind:
         iteration = 0
         
         while iteration < self.max_rounds:
-            # 1. Generate critique with context
-            critique = await self._generate_critique(query, current_response, context)
-            
-            # 2. Check stopping conditions
-            stop_reason = self._check_stopping_conditions(
-                current_response,
-                previous_response,
-                context
-            )
-            if stop_reason:
-                print(f"Stopping iteration: {stop_reason}")
-                break
+            with metrics.span("society_round"):
+                # 1. Generate critique with context
+                with metrics.span("society_critique"):
+                    critique = await self._generate_critique(query, current_response, context)
                 
-            # 3. Generate improved response
-            previous_response = current_response
-            current_response = await self._generate_improved(
-                query,
-                context,
-                critique
-            )
-            
-            iteration += 1
+                # 2. Check stopping conditions
+                with metrics.span("society_stopping_check"):
+                    stop_reason = self._check_stopping_conditions(
+                        current_response,
+                        previous_response,
+                        context
+                    )
+                if stop_reason:
+                    print(f"Stopping iteration: {stop_reason}")
+                    break
+                    
+                # 3. Generate improved response
+                previous_response = current_response
+                with metrics.span("society_improve"):
+                    current_response = await self._generate_improved(
+                        query,
+                        context,
+                        critique
+                    )
+                
+                iteration += 1
+                ROUNDS.inc()
             
-        return await self._finalize_response(current_response, context)
+        with metrics.span("society_finalize"):
+            return await self._finalize_response(current_response, context)
 
     def _check_stopping_conditions(
         self,
@@ -86,7 +107,10 @@ class SocietyMind:
         context_sim = self._calculate_similarity(response, context)
         
         key_terms = self._extract_key_terms(context)
-        coverage = sum(1 for term in key_terms if term in response) / len(key_terms)
+        coverage = (
+            sum(1 for term, _ in key_terms if term in response) / len(key_terms)
+            if key_terms else 0.0
+        )
         
         
         length_factor = min(max(len(response)/500, 0.5), 1.0)
@@ -115,7 +139,7 @@ class SocietyMind:
             response=response,
             context=context
         )
-        return await self._safe_generate(prompt)
+        return await self._safe_generate(prompt, role='critic')
 
     async def _generate_improved(
         self,
@@ -128,7 +152,7 @@ class SocietyMind:
             context=context,
             feedback=critique
         )
-        return await self._safe_generate(prompt)
+        return await self._safe_generate(prompt, role='generator')
 
     def _calculate_similarity(self, text1: str, text2: str) -> float:
         if not text1 or not text2:
@@ -136,28 +160,16 @@ class SocietyMind:
         embeddings = self.similarity_model.encode([text1, text2])
         return util.pytorch_cos_sim(embeddings[0], embeddings[1]).item()
 
-    async def _safe_generate(self, prompt: str) -> str:
+    async def _safe_generate(self, prompt: str, role: str = 'generator') -> str:
         try:
-            inputs = self.model.tokenizer(
+            response = await self.model.generate_raw_async(
                 prompt,
-                return_tensors="pt",
-                max_length=1024,
-                truncation=True
-            ).to(self.model.device)
-
-            outputs = await asyncio.to_thread(
-                self.model.model.generate,
-                **inputs,
-                max_new_tokens=500,
+                role,
                 temperature=0.7,
                 top_p=0.9,
                 repetition_penalty=1.1
             )
-            
-            return self.model.tokenizer.decode(
-                outputs[0],
-                skip_special_tokens=True
-            ).strip()
+            return response.strip()
         except Exception as e:
             raise RuntimeError(f"Generation failed: {str(e)}")
 
@@ -171,4 +183,4 @@ class SocietyMind:
             response=response,
             context=context
         )
-        return await self._safe_generate(prompt)
\ No newline at end of file
+        return await self._safe_generate(prompt, role='finalizer')
\ No newline at end of file
@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import pytest
+
+from agents.base import Agent
+from batch import BatchRunner
+from sanitizer.prompt_sanitizer import SanitizationPipeline
+
+class KeywordSanitizer:
+    def check_many(self, prompts):
+        return ["blocked keyword" if "attack" in prompt else None for prompt in prompts]
+
+class EchoAgent(Agent):
+    @staticmethod
+    def required_params():
+        return []
+
+    async def execute(self, input_data, prepared=None):
+        return f"context:{input_data}"
+
+class Crash(Exception):
+    pass
+
+class Selector:
+    def __init__(self):
+        self.agent = EchoAgent()
+        self.crash_on = None
+
+    def select_agent(self, prompt):
+        if prompt == self.crash_on:
+            raise Crash(prompt)
+        return self.agent
+
+    async def dispatch(self, agent, operation):
+        return await operation()
+
+class StubLLM:
+    def __init__(self):
+        self.calls = []
+
+    async def generate_batch_async(self, queries, contexts, mode):
+        self.calls.append(list(queries))
+        return [f"answer:{query}" for query in queries]
+
+class Orchestrator:
+    def __init__(self):
+        self.selector = Selector()
+        self.llm = StubLLM()
+
+    @staticmethod
+    def _get_mode(agent):
+        return "auto"
+
+def write_lines(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+
+def read_records(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+@pytest.fixture(autouse=True)
+def sanitizer(monkeypatch):
+    monkeypatch.setattr(SanitizationPipeline, "_sanitizer", KeywordSanitizer())
+
+def test_invalid_and_blocked_lines_get_error_records(tmp_path):
+    source, output = tmp_path / "requests.jsonl", tmp_path / "results.jsonl"
+    write_lines(source, [
+        json.dumps({"id": "a", "input": "first"}),
+        "not json",
+        json.dumps({"id": "b", "input": 42}),
+        "",
+        json.dumps({"id": "c", "input": "an attack"}),
+        json.dumps({"input": "no id"})
+    ])
+    orchestrator = Orchestrator()
+
+    summary = asyncio.run(BatchRunner(orchestrator, chunk_size=10, refine=False).run(str(source), str(output)))
+
+    records = read_records(output)
+    assert summary["processed"] == 5
+    assert [r["id"] for r in records] == ["a", 2, 3, "c", 6]
+    assert records[0] == {"id": "a", "response": "answer:first"}
+    assert records[1]["error"].startswith("Invalid request line")
+    assert records[2]["error"].startswith("Invalid request line")
+    assert records[3]["error"].startswith("Request blocked for security reasons")
+    assert records[4] == {"id": 6, "response": "answer:no id"}
+    # Строки с ошибками до LLM не доходят
+    assert orchestrator.llm.calls == [["first", "no id"]]
+
+def test_resume_after_a_crash_mid_chunk(tmp_path):
+    source, output = tmp_path / "requests.jsonl", tmp_path / "results.jsonl"
+    write_lines(source, [json.dumps({"id": i, "input": f"q{i}"}) for i in range(5)])
+    orchestrator = Orchestrator()
+    orchestrator.selector.crash_on = "q3"
+
+    with pytest.raises(Crash):
+        asyncio.run(BatchRunner(orchestrator, chunk_size=2, refine=False).run(str(source), str(output)))
+    assert [r["id"] for r in read_records(output)] == [0, 1]
+    # Недописанная при падении запись
+    with open(output, "a") as f:
+        f.write('{"id": 2, "resp')
+
+    orchestrator.selector.crash_on = None
+    summary = asyncio.run(BatchRunner(orchestrator, chunk_size=2, refine=False).run(str(source), str(output)))
+
+    assert summary["processed"] == 3
+    assert summary["total_lines"] == 5
+    assert read_records(output) == [{"id": i, "response": f"answer:q{i}"} for i in range(5)]
+
+def test_finished_run_is_not_repeated(tmp_path):
+    source, output = tmp_path / "requests.jsonl", tmp_path / "results.jsonl"
+    write_lines(source, [json.dumps({"id": i, "input": f"q{i}"}) for i in range(3)])
+    runner = BatchRunner(Orchestrator(), chunk_size=2, refine=False)
+
+    asyncio.run(runner.run(str(source), str(output)))
+    summary = asyncio.run(runner.run(str(source), str(output)))
+
+    assert summary["processed"] == 0
+    assert len(read_records(output)) == 3
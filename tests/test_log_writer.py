@@ -0,0 +1,20 @@
+from utils.log_writer import LogWriter
+from utils.metrics import metrics
+
+def test_dropped_records_are_exported(tmp_path):
+    writer = LogWriter(str(tmp_path / "events.jsonl"))
+    writer.close()
+
+    assert not writer.emit({"type": "late"})
+    assert writer.stats()["dropped"] == 1
+    assert f'log_records_dropped_total{{log="{tmp_path / "events.jsonl"}"}} 1.0' in metrics.render()
+
+def test_close_drains_the_queue(tmp_path):
+    path = tmp_path / "events.jsonl"
+    writer = LogWriter(str(path), flush_interval=0.01)
+    for i in range(100):
+        writer.emit({"i": i})
+    writer.close()
+
+    assert writer.stats()["written"] == 100
+    assert len(path.read_text().splitlines()) == 100
@@ -0,0 +1,135 @@
+import asyncio
+import os
+
+from agents.base import Agent
+from agents.pdf_file_agent import PDFFileAgent
+from main import AIOrchestrator
+from sanitizer.prompt_sanitizer import SanitizationPipeline
+from utils.cache import DataHasher, FingerprintIndex, SmartCache
+from utils.exceptions import PDFProcessingError
+from utils.stages import StageMemo, StageTrace
+
+class PassSanitizer:
+    version = "test-sanitizer"
+
+    def sanitize(self, prompt: str) -> str:
+        return prompt
+
+class MissingFileAgent(Agent):
+    @staticmethod
+    def required_params():
+        return []
+
+    async def execute(self, input_data, prepared=None):
+        raise PDFProcessingError("File not found")
+
+class ContextAgent(Agent):
+    @staticmethod
+    def required_params():
+        return []
+
+    async def execute(self, input_data, prepared=None):
+        return "context"
+
+class StubLLM:
+    version = "stub-llm"
+
+    def template_version(self, mode: str) -> str:
+        return "stub-template"
+
+    async def generate_async(self, query, context, mode):
+        return "draft"
+
+class StubSociety:
+    version = "stub-society"
+
+    async def refine_response(self, query, context, initial_response):
+        return "final"
+
+class Selector:
+    def __init__(self, agent: Agent):
+        self.agent = agent
+
+    def select_agent(self, prompt: str) -> Agent:
+        return self.agent
+
+    async def dispatch(self, agent, operation):
+        return await operation()
+
+class RecordingCache:
+    def __init__(self):
+        self.lookups = []
+        self.saved = []
+
+    async def lookup(self, prompt, context, data_hash):
+        self.lookups.append(data_hash)
+        return None
+
+    async def save_response(self, prompt, context, response, data_hash, metadata=None):
+        self.saved.append(data_hash)
+
+def make_orchestrator(tmp_path, agent: Agent, cache=None) -> AIOrchestrator:
+    orchestrator = AIOrchestrator(
+        llm=StubLLM(),
+        selector=Selector(agent),
+        society=StubSociety(),
+        cache_manager=cache or RecordingCache(),
+        memo=StageMemo(SmartCache(cache_dir=str(tmp_path / "stages")))
+    )
+    orchestrator.speculative = False
+    return orchestrator
+
+def test_missing_upload_is_a_processing_error(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("config.UPLOAD_DIR", str(tmp_path / "uploads"))
+    monkeypatch.setattr(SanitizationPipeline, "_sanitizer", PassSanitizer())
+    orchestrator = make_orchestrator(tmp_path, MissingFileAgent())
+    trace = StageTrace()
+
+    response = asyncio.run(orchestrator.process_request(
+        "Summarize <uploaded_file>missing.pdf</uploaded_file>", trace
+    ))
+
+    assert response == "Error processing your request"
+    assert trace.recomputed == ["sanitize"]
+
+def test_upload_path_rejects_files_the_agent_would_refuse(tmp_path, monkeypatch):
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    (upload_dir / "doc.pdf").write_bytes(b"%PDF-1.4")
+    (tmp_path / "secret.pdf").write_bytes(b"secret")
+    os.mkfifo(upload_dir / "pipe.pdf")
+    with open(upload_dir / "large.pdf", "wb") as f:
+        f.truncate(PDFFileAgent.MAX_FILE_SIZE + 1)
+    monkeypatch.setattr("config.UPLOAD_DIR", str(upload_dir))
+
+    assert AIOrchestrator._upload_path("doc.pdf") == (upload_dir / "doc.pdf").resolve()
+    assert AIOrchestrator._upload_path("../secret.pdf") is None
+    assert AIOrchestrator._upload_path("/dev/zero") is None
+    assert AIOrchestrator._upload_path("pipe.pdf") is None
+    assert AIOrchestrator._upload_path("large.pdf") is None
+    assert AIOrchestrator._upload_path("missing.pdf") is None
+
+def test_new_upload_skips_lookup_and_hashes_alongside_the_agent(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    (upload_dir / "doc.pdf").write_bytes(b"%PDF-1.4 " * 50000)
+    monkeypatch.setattr("config.UPLOAD_DIR", str(upload_dir))
+    monkeypatch.setattr(SanitizationPipeline, "_sanitizer", PassSanitizer())
+    monkeypatch.setattr(DataHasher, "_index", FingerprintIndex(index_path=str(tmp_path / "fingerprints.json")))
+    cache = RecordingCache()
+    orchestrator = make_orchestrator(tmp_path, ContextAgent(), cache)
+    prompt = "Summarize <uploaded_file>doc.pdf</uploaded_file>"
+    file_hash = DataHasher.hash_content((upload_dir / "doc.pdf").read_bytes())
+
+    first, second = StageTrace(), StageTrace()
+    assert asyncio.run(orchestrator.process_request(prompt, first)) == "final"
+    assert asyncio.run(orchestrator.process_request(prompt, second)) == "final"
+
+    # Первый запрос: отпечаток неизвестен, поиска в кэше нет, хэш
+    # досчитан для сохранения; второй находит файл и переиспользует стадии
+    assert cache.lookups == [file_hash]
+    assert cache.saved == [file_hash, file_hash]
+    assert first.recomputed == ["sanitize", "context", "generate", "refine"]
+    assert second.reused == ["sanitize", "context", "generate", "refine"]
@@ -0,0 +1,100 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from agents.pool import outer_slot
+from server import OrchestratorServer
+from utils.exceptions import AgentOverloaded
+
+class StubOrchestrator:
+    """Ответ зависит от текста запроса; "wait" ждет release,
+    "pool" ждет его же, отдав слот сервера, как задача в пуле агента"""
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.started = asyncio.Event()
+
+    async def process_request(self, user_input, trace):
+        if user_input == "blocked":
+            trace.blocked = "pattern"
+            return "Request blocked for security reasons"
+        if user_input == "broken":
+            trace.failed = "boom"
+            return "Internal server error"
+        if user_input == "busy":
+            trace.rejected = str(AgentOverloaded("pdf_file"))
+            return "Service is busy, please retry"
+        if user_input == "wait":
+            self.started.set()
+            await self.release.wait()
+        if user_input == "pool":
+            async with outer_slot.get().yielded():
+                self.started.set()
+                await self.release.wait()
+        return f"answer:{user_input}"
+
+async def with_client(server, scenario):
+    async with TestClient(TestServer(server.build_app())) as client:
+        return await scenario(client)
+
+def ask(client, text):
+    return client.post("/ask", json={"input": text})
+
+def test_statuses_follow_the_outcome():
+    async def scenario(client):
+        statuses = {}
+        for text in ("hello", "blocked", "broken", "busy"):
+            async with ask(client, text) as response:
+                statuses[text] = (response.status, await response.json())
+        async with client.post("/ask", data=b"not json") as response:
+            statuses["invalid"] = (response.status, None)
+        return statuses
+
+    statuses = asyncio.run(with_client(OrchestratorServer(StubOrchestrator()), scenario))
+
+    assert statuses["hello"][0] == 200
+    assert statuses["hello"][1]["response"] == "answer:hello"
+    assert statuses["blocked"] == (403, {"error": "Request blocked for security reasons"})
+    assert statuses["broken"] == (500, {"error": "Internal server error"})
+    assert statuses["busy"][0] == 503
+    assert statuses["invalid"][0] == 400
+
+def test_saturated_server_answers_429():
+    async def scenario(client):
+        orchestrator = server.orchestrator
+        first = asyncio.ensure_future(ask(client, "wait"))
+        await orchestrator.started.wait()
+        async with ask(client, "hello") as response:
+            rejected = response.status
+        orchestrator.release.set()
+        async with await first as response:
+            accepted = response.status
+        return rejected, accepted
+
+    server = OrchestratorServer(StubOrchestrator(), max_in_flight=1, max_queue=0)
+    assert asyncio.run(with_client(server, scenario)) == (429, 200)
+    assert (server.in_flight, server.queued) == (0, 0)
+
+def test_timeout_in_agent_pool_does_not_wait_for_a_slot():
+    async def scenario(client):
+        orchestrator = server.orchestrator
+        # Запрос в пуле отдал слот, его занял следующий и держит
+        pooled = asyncio.ensure_future(ask(client, "pool"))
+        await orchestrator.started.wait()
+        orchestrator.started.clear()
+        await asyncio.sleep(0.1)
+        holder = asyncio.ensure_future(ask(client, "wait"))
+        await orchestrator.started.wait()
+
+        async with await pooled as response:
+            timed_out = response.status
+            # 504 пришел, пока слот еще занят
+            slot_still_held = not holder.done()
+        orchestrator.release.set()
+        async with await holder as response:
+            await response.read()
+        return timed_out, slot_still_held
+
+    server = OrchestratorServer(StubOrchestrator(), max_in_flight=1, max_queue=4, request_timeout=0.3)
+    assert asyncio.run(with_client(server, scenario)) == (504, True)
+    assert (server.in_flight, server.queued) == (0, 0)
+    assert not server._slots.locked()
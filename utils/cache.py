@@ -1,9 +1,21 @@
+import asyncio
+import atexit
 import hashlib
 import json
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple, Iterable, TYPE_CHECKING
+
+import numpy as np
+
+import config
+
+if TYPE_CHECKING:
+    from llm.phi_wrapper import PhiLLM
 
 class SmartCache:
     def __init__(self, cache_dir: str = "cache", ttl: int = 86400):
@@ -32,14 +44,16 @@ class SmartCache:
         """Проверка наличия записи в кэше"""
         key_path = self._get_key_path(key)
         
-        if not key_path.exists():
+        # Кэш может разделяться несколькими процессами-воркерами:
+        # запись могут удалить или заменить между проверкой и чтением
+        try:
+            with open(key_path, 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
             return None
-
-        with open(key_path, 'r') as f:
-            entry = json.load(f)
             
         if self._is_expired(entry['timestamp']):
-            key_path.unlink()
+            key_path.unlink(missing_ok=True)
             return None
             
         return entry['response']
@@ -57,33 +71,582 @@ class SmartCache:
             'metadata': metadata or {}
         }
         
-        with open(self._get_key_path(key), 'w') as f:
+        # Атомарная запись: читатели в других процессах не увидят
+        # частично записанный файл
+        key_path = self._get_key_path(key)
+        tmp_path = key_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w') as f:
             json.dump(entry, f)
+        os.replace(tmp_path, key_path)
 
     def _is_expired(self, timestamp: str) -> bool:
         """Проверка истечения срока жизни записи"""
         entry_time = datetime.fromisoformat(timestamp)
         return (datetime.now() - entry_time).total_seconds() > self.ttl
 
+class FingerprintIndex:
+    """Персистентный индекс отпечатков файлов.
+
+    Запись привязана к (path, size, mtime_ns, inode): пока файл не
+    изменился, полный хэш берется из индекса без чтения содержимого.
+    Дополнительно хранится быстрый частичный отпечаток (начало,
+    конец и размер файла). На диск индекс сбрасывается не чаще раза
+    в ``save_interval`` секунд и при завершении процесса. Файл может
+    делиться между процессами (воркерами сервера): перед записью в
+    индекс вливаются чужие записи с диска, а при промахе файл
+    перечитывается, если его изменил другой процесс.
+    """
+    def __init__(
+        self,
+        index_path: str = config.FINGERPRINT_INDEX_PATH,
+        max_entries: int = 10000,
+        save_interval: float = config.FINGERPRINT_SAVE_INTERVAL
+    ):
+        self.index_path = Path(index_path)
+        self.max_entries = max_entries
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._partials: Dict[str, int] = {}
+        self._disk_version: Optional[int] = None
+        self._merge_disk()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        atexit.register(self.flush)
+
+    def _merge_disk(self) -> bool:
+        """Добавление записей, сохраненных другими процессами.
+
+        Вызывается под блокировкой; файл читается, только если он
+        изменился после последнего чтения или записи.
+        """
+        try:
+            version = self.index_path.stat().st_mtime_ns
+            if version == self._disk_version:
+                return False
+            with open(self.index_path, 'r') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        self._disk_version = version
+        added = False
+        for path, entry in entries.items():
+            if path not in self._entries:
+                self._entries[path] = entry
+                self._partials[entry['partial']] = self._partials.get(entry['partial'], 0) + 1
+                added = True
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        return added
+
+    def flush(self):
+        """Запись индекса на диск, если он менялся"""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._merge_disk()
+            snapshot = dict(self._entries)
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+        self.index_path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = self.index_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, self.index_path)
+        with self._lock:
+            self._disk_version = self.index_path.stat().st_mtime_ns
+
+    @staticmethod
+    def stat_key(stat: os.stat_result) -> List[int]:
+        return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+    def get(self, file_path: Path, stat: os.stat_result) -> Optional[str]:
+        """Полный хэш неизменившегося файла"""
+        entry = self._entries.get(str(file_path))
+        if entry is None:
+            with self._lock:
+                if self._merge_disk():
+                    entry = self._entries.get(str(file_path))
+        if entry and entry['stat'] == self.stat_key(stat):
+            return entry['sha256']
+        return None
+
+    def has_partial(self, partial: str) -> bool:
+        if partial in self._partials:
+            return True
+        with self._lock:
+            self._merge_disk()
+            return partial in self._partials
+
+    def put(self, file_path: Path, stat: os.stat_result, partial: str, full_hash: str):
+        with self._lock:
+            self._remove(str(file_path))
+            self._entries[str(file_path)] = {
+                'stat': self.stat_key(stat),
+                'partial': partial,
+                'sha256': full_hash
+            }
+            self._partials[partial] = self._partials.get(partial, 0) + 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+            self._dirty = True
+            due = time.monotonic() - self._last_save >= self.save_interval
+        if due:
+            self.flush()
+
+    def _remove(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        count = self._partials.get(entry['partial'], 0) - 1
+        if count > 0:
+            self._partials[entry['partial']] = count
+        else:
+            self._partials.pop(entry['partial'], None)
+
 class DataHasher:
+    CHUNK_SIZE = 1024 * 1024
+    PARTIAL_SIZE = 64 * 1024
+    _index: Optional[FingerprintIndex] = None
+
+    @classmethod
+    def index(cls) -> FingerprintIndex:
+        if cls._index is None:
+            cls._index = FingerprintIndex()
+        return cls._index
+
     @staticmethod
     def hash_content(content: bytes) -> str:
         return hashlib.sha256(content).hexdigest()
 
     @classmethod
     def hash_file(cls, file_path: Path) -> str:
+        """Полный хэш файла; неизменившиеся файлы не перечитываются"""
+        file_path = Path(file_path).resolve()
+        stat = file_path.stat()
+        index = cls.index()
+        if cached := index.get(file_path, stat):
+            return cached
+
+        full_hash = cls._stream_hash(file_path)
+        index.put(file_path, stat, cls.partial_fingerprint(file_path, stat.st_size), full_hash)
+        return full_hash
+
+    @classmethod
+    def may_be_known(cls, file_path: Path) -> bool:
+        """Быстрый префильтр: False означает, что содержимое файла
+        еще не хэшировалось, и записей кэша для него быть не может"""
+        file_path = Path(file_path).resolve()
+        stat = file_path.stat()
+        index = cls.index()
+        if index.get(file_path, stat):
+            return True
+        return index.has_partial(cls.partial_fingerprint(file_path, stat.st_size))
+
+    @classmethod
+    def partial_fingerprint(cls, file_path: Path, size: int) -> str:
+        """Отпечаток по размеру, началу и концу файла"""
+        digest = hashlib.sha256(size.to_bytes(8, 'little'))
         with open(file_path, 'rb') as f:
-            return cls.hash_content(f.read())
+            digest.update(f.read(cls.PARTIAL_SIZE))
+            if size > cls.PARTIAL_SIZE:
+                f.seek(max(size - cls.PARTIAL_SIZE, cls.PARTIAL_SIZE))
+                digest.update(f.read(cls.PARTIAL_SIZE))
+        return digest.hexdigest()
+
+    @classmethod
+    def _stream_hash(cls, file_path: Path) -> str:
+        """Потоковое хэширование с буфером фиксированного размера"""
+        digest = hashlib.sha256()
+        buffer = bytearray(cls.CHUNK_SIZE)
+        view = memoryview(buffer)
+        with open(file_path, 'rb', buffering=0) as f:
+            while read := f.readinto(buffer):
+                digest.update(view[:read])
+        return digest.hexdigest()
 
     @classmethod
     def hash_code(cls, code: str) -> str:
         return cls.hash_content(code.encode())
 
+class SemanticIndex:
+    """Векторный индекс эмбеддингов промптов в рамках одного набора данных.
+
+    Небольшие индексы просматриваются полным перебором. После
+    ``brute_force_limit`` записей кандидаты отбираются через LSH
+    (случайные гиперплоскости), и точное косинусное сходство
+    считается только для них. Размер ограничен ``max_entries``:
+    повторный ключ перезаписывает свою запись, при переполнении
+    вытесняется самая старая. Записи старше ``ttl`` не возвращаются.
+    """
+    def __init__(
+        self,
+        dim: int,
+        num_tables: int = 16,
+        num_bits: int = 12,
+        brute_force_limit: int = 4096,
+        max_entries: int = config.SEMANTIC_CACHE_MAX_ENTRIES,
+        ttl: int = 86400,
+        seed: int = 0
+    ):
+        self.dim = dim
+        self.brute_force_limit = brute_force_limit
+        self.max_entries = max_entries
+        self.ttl = ttl
+        capacity = min(1024, max_entries)
+        self._vectors = np.empty((capacity, dim), dtype=np.float32)
+        self._added = np.empty(capacity, dtype=np.float64)
+        self._keys: List[Optional[str]] = []
+        # Ключ -> слот в порядке добавления: первым вытесняется начало
+        self._slots: "OrderedDict[str, int]" = OrderedDict()
+        self._slot_buckets: List[Optional[np.ndarray]] = []
+        self._free: List[int] = []
+        rng = np.random.default_rng(seed)
+        self._planes = rng.standard_normal((num_tables, num_bits, dim)).astype(np.float32)
+        self._powers = (1 << np.arange(num_bits)).astype(np.int64)
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(num_tables)]
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def add(self, vector: np.ndarray, key: str, added: Optional[float] = None):
+        """Добавление нормированного вектора"""
+        idx = self._slots.pop(key, None)
+        if idx is not None:
+            self._unlink(idx)
+        elif self._free:
+            idx = self._free.pop()
+        elif len(self._keys) < self.max_entries:
+            idx = len(self._keys)
+            self._grow(idx + 1)
+            self._keys.append(None)
+            self._slot_buckets.append(None)
+        else:
+            # Вытесняется самая давно добавленная запись
+            _, idx = self._slots.popitem(last=False)
+            self._unlink(idx)
+
+        self._vectors[idx] = vector
+        self._added[idx] = time.time() if added is None else added
+        self._keys[idx] = key
+        self._slots[key] = idx
+        buckets = self._buckets(vector)
+        self._slot_buckets[idx] = buckets
+        for table, bucket in zip(self._tables, buckets):
+            table.setdefault(int(bucket), []).append(idx)
+
+    def discard(self, key: str):
+        """Удаление записи, например если ответ уже вытеснен из кэша"""
+        idx = self._slots.pop(key, None)
+        if idx is not None:
+            self._unlink(idx)
+            self._keys[idx] = None
+            self._free.append(idx)
+
+    def search(self, vector: np.ndarray, top_k: int = 5) -> List[Tuple[str, float]]:
+        """Ближайшие живые соседи: [(ключ кэша, косинусное сходство)]"""
+        size = len(self._keys)
+        if not self._slots:
+            return []
+
+        if size <= self.brute_force_limit:
+            ids = np.arange(size)
+        else:
+            candidates = set()
+            for table, bucket in zip(self._tables, self._buckets(vector)):
+                candidates.update(table.get(int(bucket), ()))
+            if not candidates:
+                return []
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+
+        scores = self._vectors[ids] @ vector
+        alive = self._added[ids] >= time.time() - self.ttl
+        order = np.argsort(-scores)
+        results = []
+        for position in order:
+            idx = int(ids[position])
+            key = self._keys[idx]
+            if key is None or not alive[position]:
+                continue
+            results.append((key, float(scores[position])))
+            if len(results) == top_k:
+                break
+        return results
+
+    def save(self, path: Path):
+        """Атомарное сохранение живых записей"""
+        live = list(self._slots.values())
+        path.parent.mkdir(exist_ok=True, parents=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp.npz")
+        np.savez(
+            tmp_path,
+            vectors=self._vectors[live],
+            added=self._added[live],
+            keys=np.array([self._keys[idx] for idx in live], dtype=str)
+        )
+        os.replace(tmp_path, path)
+
+    def merge(self, path: Path) -> int:
+        """Добавление живых записей из файла, которых нет в памяти"""
+        with np.load(path) as data:
+            vectors, added, keys = data["vectors"], data["added"], data["keys"]
+        if vectors.shape[1:] != (self.dim,):
+            return 0
+        cutoff = time.time() - self.ttl
+        merged = 0
+        for position in np.argsort(added, kind="stable"):
+            key = str(keys[position])
+            if key not in self._slots and added[position] >= cutoff:
+                self.add(vectors[position], key, float(added[position]))
+                merged += 1
+        return merged
+
+    @classmethod
+    def load(cls, path: Path, **kwargs) -> "SemanticIndex":
+        with np.load(path) as data:
+            vectors, added, keys = data["vectors"], data["added"], data["keys"]
+            index = cls(dim=vectors.shape[1], **kwargs)
+            for vector, timestamp, key in zip(vectors, added, keys):
+                index.add(vector, str(key), float(timestamp))
+        return index
+
+    def _grow(self, size: int):
+        if size <= len(self._vectors):
+            return
+        capacity = min(len(self._vectors) * 2, self.max_entries)
+        vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        vectors[:len(self._vectors)] = self._vectors
+        added = np.empty(capacity, dtype=np.float64)
+        added[:len(self._added)] = self._added
+        self._vectors, self._added = vectors, added
+
+    def _unlink(self, idx: int):
+        buckets = self._slot_buckets[idx]
+        if buckets is None:
+            return
+        for table, bucket in zip(self._tables, buckets):
+            table[int(bucket)].remove(idx)
+        self._slot_buckets[idx] = None
+
+    def _buckets(self, vector: np.ndarray) -> np.ndarray:
+        bits = (self._planes @ vector) > 0
+        return bits @ self._powers
+
+class SemanticCache:
+    """Семантический слой кэша для перефразированных запросов.
+
+    Для каждого хэша данных (документ, код или их отсутствие) хранится
+    отдельный индекс, поэтому ответы никогда не переиспользуются
+    между разными документами. В памяти держится не больше
+    ``max_indexes`` индексов; они периодически сбрасываются на диск
+    и подгружаются при следующем обращении. Каталог может делиться
+    между процессами: перед записью в индекс вливаются записи из
+    файла, а индекс в памяти не реже раза в ``save_interval`` секунд
+    дополняется, если файл изменил другой процесс.
+    """
+    EMBED_MEMO_SIZE = 1024
+
+    def __init__(
+        self,
+        embedding_model=None,
+        threshold: float = config.SEMANTIC_CACHE_THRESHOLD,
+        model_name: str = config.SEMANTIC_CACHE_MODEL,
+        ttl: int = 86400,
+        max_entries: int = config.SEMANTIC_CACHE_MAX_ENTRIES,
+        max_indexes: int = config.SEMANTIC_CACHE_MAX_INDEXES,
+        persist_dir: Optional[str] = config.SEMANTIC_CACHE_DIR,
+        save_interval: float = config.SEMANTIC_CACHE_SAVE_INTERVAL
+    ):
+        self.threshold = threshold
+        self.model_name = model_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_indexes = max_indexes
+        self.persist_dir = Path(persist_dir) if persist_dir else None
+        self.save_interval = save_interval
+        self._embedding_model = embedding_model
+        self._indexes: "OrderedDict[str, SemanticIndex]" = OrderedDict()
+        # data_hash -> (mtime_ns прочитанного или записанного файла, время проверки)
+        self._disk_versions: Dict[str, Tuple[Optional[int], float]] = {}
+        self._dirty: set = set()
+        self._last_save = time.monotonic()
+        self._vectors: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.RLock()
+        if self.persist_dir:
+            atexit.register(self.flush)
+
+    @property
+    def embedding_model(self):
+        if self._embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            self._embedding_model = SentenceTransformer(self.model_name)
+        return self._embedding_model
+
+    def embed(self, prompt: str) -> np.ndarray:
+        """Нормированный эмбеддинг промпта.
+
+        Последние эмбеддинги запоминаются: промах поиска и последующее
+        сохранение ответа считают эмбеддинг один раз.
+        """
+        with self._lock:
+            if (vector := self._vectors.get(prompt)) is not None:
+                self._vectors.move_to_end(prompt)
+                return vector
+
+        vector = self.embedding_model.encode(prompt, convert_to_numpy=True)
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+
+        with self._lock:
+            self._vectors[prompt] = vector
+            while len(self._vectors) > self.EMBED_MEMO_SIZE:
+                self._vectors.popitem(last=False)
+        return vector
+
+    def lookup(self, prompt: str, data_hash: str) -> List[Tuple[str, float]]:
+        """Ключи кэша похожих промптов по тем же данным, от лучшего к худшему"""
+        with self._lock:
+            if self._index(data_hash, create=False) is None:
+                return []
+        vector = self.embed(prompt)
+        with self._lock:
+            index = self._index(data_hash, create=False)
+            if index is None:
+                return []
+            return [match for match in index.search(vector) if match[1] >= self.threshold]
+
+    def add(self, prompt: str, data_hash: str, key: str):
+        """Регистрация промпта и ключа сохраненного ответа"""
+        vector = self.embed(prompt)
+        with self._lock:
+            self._index(data_hash, create=True, dim=vector.shape[0]).add(vector, key)
+            self._dirty.add(data_hash)
+            if time.monotonic() - self._last_save >= self.save_interval:
+                self.flush()
+
+    def discard(self, data_hash: str, key: str):
+        """Удаление ключа, ответ по которому больше не хранится"""
+        with self._lock:
+            index = self._indexes.get(data_hash)
+            if index is not None:
+                index.discard(key)
+                self._dirty.add(data_hash)
+
+    def flush(self):
+        """Сброс измененных индексов на диск"""
+        with self._lock:
+            if self.persist_dir:
+                for data_hash in list(self._dirty):
+                    if data_hash in self._indexes:
+                        self._save(data_hash, self._indexes[data_hash])
+            self._dirty.clear()
+            self._last_save = time.monotonic()
+
+    def _index_path(self, data_hash: str) -> Path:
+        return self.persist_dir / f"{data_hash}.npz"
+
+    def _disk_version(self, path: Path) -> Optional[int]:
+        try:
+            return path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _sync(self, data_hash: str, index: SemanticIndex, force: bool = False):
+        """Вливание записей из файла индекса, если его изменил другой процесс"""
+        seen, checked = self._disk_versions.get(data_hash, (None, 0.0))
+        now = time.monotonic()
+        if not force and now - checked < self.save_interval:
+            return
+        path = self._index_path(data_hash)
+        version = self._disk_version(path)
+        if version is not None and version != seen:
+            try:
+                index.merge(path)
+            except (OSError, ValueError, KeyError):
+                pass
+        self._disk_versions[data_hash] = (version, now)
+
+    def _save(self, data_hash: str, index: SemanticIndex):
+        self._sync(data_hash, index, force=True)
+        path = self._index_path(data_hash)
+        index.save(path)
+        self._disk_versions[data_hash] = (self._disk_version(path), time.monotonic())
+
+    def _index(self, data_hash: str, create: bool, dim: Optional[int] = None) -> Optional[SemanticIndex]:
+        index = self._indexes.get(data_hash)
+        if index is not None:
+            self._indexes.move_to_end(data_hash)
+            if self.persist_dir:
+                self._sync(data_hash, index)
+            return index
+
+        path = self._index_path(data_hash) if self.persist_dir else None
+        if path is not None and path.exists():
+            try:
+                version = self._disk_version(path)
+                index = SemanticIndex.load(path, max_entries=self.max_entries, ttl=self.ttl)
+                self._disk_versions[data_hash] = (version, time.monotonic())
+            except (OSError, ValueError, KeyError):
+                index = None
+        if index is None:
+            if not create:
+                return None
+            index = SemanticIndex(dim=dim, max_entries=self.max_entries, ttl=self.ttl)
+
+        self._indexes[data_hash] = index
+        while len(self._indexes) > self.max_indexes:
+            evicted, evicted_index = self._indexes.popitem(last=False)
+            if evicted in self._dirty and self.persist_dir:
+                self._save(evicted, evicted_index)
+            self._dirty.discard(evicted)
+            self._disk_versions.pop(evicted, None)
+        return index
+
+    def evaluate(
+        self,
+        labelled_pairs: Iterable[Tuple[str, str, bool]]
+    ) -> Dict[str, float]:
+        """Precision/recall порога на размеченном наборе перефразов.
+
+        Каждый элемент - (промпт, промпт, является ли перефразом).
+        """
+        tp = fp = fn = tn = 0
+        for first, second, is_paraphrase in labelled_pairs:
+            score = float(self.embed(first) @ self.embed(second))
+            predicted = score >= self.threshold
+            if predicted and is_paraphrase:
+                tp += 1
+            elif predicted:
+                fp += 1
+            elif is_paraphrase:
+                fn += 1
+            else:
+                tn += 1
+
+        return {
+            'threshold': self.threshold,
+            'precision': tp / (tp + fp) if tp + fp else 1.0,
+            'recall': tp / (tp + fn) if tp + fn else 0.0,
+            'true_positives': tp,
+            'false_positives': fp,
+            'false_negatives': fn,
+            'true_negatives': tn
+        }
+
 class CacheManager:
-    def __init__(self, model: PhiLLM): #? Решить вопрос с PhiLLM
+    UNSCOPED = "unscoped"
+
+    def __init__(
+        self,
+        model: "PhiLLM",
+        semantic_cache: Optional[SemanticCache] = None
+    ):
         self.cache = SmartCache()
         self.model = model
         self.hasher = DataHasher()
+        self.semantic = semantic_cache or SemanticCache()
 
     async def process_request(
         self,
@@ -93,19 +656,66 @@ class CacheManager:
         code: Optional[str] = None
     ) -> Optional[str]:
         data_hash = self._get_data_hash(data_source, code)
-        
+        return await self.lookup(prompt, context, data_hash)
+
+    async def lookup(self, prompt: str, context: str, data_hash: Optional[str]) -> Optional[str]:
+        """Поиск ответа: сначала точный ключ, затем семантически близкий промпт.
+
+        Без хэша данных (``None``) ищется только точное совпадение:
+        похожий промпт мог относиться к другому документу.
+        """
         cache_key = self.cache.generate_key(
             prompt=prompt,
             context=context,
             model_version=self.model.version,
-            data_hash=data_hash
+            data_hash=data_hash or self.UNSCOPED
         )
         
         if cached := self.cache.check_cache(cache_key):
             return cached
-        
+        if data_hash is None:
+            return None
+
+        # Эмбеддинг считается в потоке, чтобы не блокировать цикл событий
+        scope = self._semantic_scope(data_hash)
+        matches = await asyncio.to_thread(self.semantic.lookup, prompt, scope)
+        for semantic_key, _ in matches:
+            if cached := self.cache.check_cache(semantic_key):
+                return cached
+            # Ответ истек или удален: вектор больше не должен заслонять соседей
+            self.semantic.discard(scope, semantic_key)
+
         return None
 
+    async def save_response(
+        self,
+        prompt: str,
+        context: str,
+        response: str,
+        data_hash: Optional[str],
+        metadata: Optional[Dict] = None
+    ):
+        """Сохранение ответа в точный и семантический кэш"""
+        cache_key = self.cache.generate_key(
+            prompt=prompt,
+            context=context,
+            model_version=self.model.version,
+            data_hash=data_hash or self.UNSCOPED
+        )
+        self.cache.save_cache(cache_key, response, metadata)
+        if data_hash is None:
+            return
+        await asyncio.to_thread(self.semantic.add, prompt, self._semantic_scope(data_hash), cache_key)
+
+    def _semantic_scope(self, data_hash: str) -> str:
+        """Индекс семантического слоя: данные плюс версия модели.
+
+        Ключи из индекса проверяются как есть, поэтому без версии в
+        области смена модели, шаблона или политики генерации не
+        инвалидировала бы семантические попадания.
+        """
+        return hashlib.sha256(f"{self.model.version}:{data_hash}".encode()).hexdigest()
+
     def _get_data_hash(
         self,
         data_source: Optional[Path],
@@ -116,34 +726,3 @@ class CacheManager:
         if code:
             return self.hasher.hash_code(code)
         return "no_data"
-
-async def handle_user_request(prompt: str, context: str, file_path: Path):
-    model = PhiLLM()
-    cache_manager = CacheManager(model)
-    
-    cached_response = await cache_manager.process_request(
-        prompt=prompt,
-        context=context,
-        data_source=file_path
-    )
-    
-    if cached_response:
-        return cached_response
-    
-    response = await process_request(prompt, context, file_path)
-    
-    cache_manager.cache.save_cache(
-        key=cache_manager.cache.generate_key(
-            prompt=prompt,
-            context=context,
-            model_version=model.version,
-            data_hash=cache_manager.hasher.hash_file(file_path)
-        ),
-        response=response,
-        metadata={
-            'source': str(file_path),
-            'model_version': model.version
-        }
-    )
-    
-    return response
\ No newline at end of file
@@ -1,10 +1,12 @@
+import asyncio
 import docker
 from docker.errors import DockerException
 from .exceptions import DockerSecurityException, ResourceLimitExceeded, CodeExecutionError
 
 class DockerSandbox:
-    def __init__(self):
-        self.client = docker.from_env()
+    def __init__(self, config: dict = None, client=None):
+        self.config = config or {}
+        self.client = client or self.config.get("client") or docker.from_env()
         self._validate_docker()
         
     def _validate_docker(self):
@@ -15,7 +17,11 @@ class DockerSandbox:
 
     async def execute(self, code: str, timeout=10, mem_limit='100m') -> str:
         self._check_code_safety(code)
-        
+        # Клиент docker синхронный: запуск и ожидание контейнера
+        # выполняются в потоке, чтобы не блокировать цикл событий
+        return await asyncio.to_thread(self._run, code, timeout, mem_limit)
+
+    def _run(self, code: str, timeout, mem_limit) -> str:
         try:
             container = self.client.containers.run(
                 image="python-sandbox:secure",
@@ -30,7 +30,20 @@ class ResourceLimitExceeded(ProcessingError):
     def __init__(self, resource_type):
         super().__init__(f"{resource_type} limit exceeded")
 
+class AgentOverloaded(ResourceLimitExceeded):
+    """Agent pool queue is full"""
+    def __init__(self, agent_type):
+        super().__init__(f"{agent_type} agent queue")
+
 class NetworkError(ProcessingError):
     """Network-related errors"""
     def __init__(self, url):
-        super().__init__(f"Network operation failed for: {url}")
\ No newline at end of file
+        super().__init__(f"Network operation failed for: {url}")
+class AgentSelectionError(ProcessingError):
+    """Agent selection errors"""
+    def __init__(self, reason):
+        super().__init__(reason)
+
+class QualityThresholdReached(Exception):
+    """Raised when refinement reaches the quality threshold"""
+    pass
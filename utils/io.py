@@ -1,5 +1,7 @@
 import datetime
 import os
+import config
+from .log_writer import get_log_writer
 
 def get_input_data():
     return input("Enter your question/code/link or upload: ")
@@ -8,6 +10,9 @@ def send_response_to_user(response):
     print("\n\n[Final Response]:\n", response)
 
 def log_request(prompt, response):
-    log_line = f"{datetime.datetime.now().isoformat()} | PROMPT: {prompt}\nRESPONSE: {response}\n{'='*80}\n"
-    with open("logs/request_log.txt", "a") as log_file:
-        log_file.write(log_line)
\ No newline at end of file
+    get_log_writer(config.REQUEST_LOG_PATH).emit({
+        'timestamp': datetime.datetime.now().isoformat(),
+        'type': 'request',
+        'prompt': prompt,
+        'response': response
+    })
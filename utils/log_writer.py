@@ -0,0 +1,171 @@
+import atexit
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+from pathlib import Path
+from typing import Any, Dict
+
+import config
+from .metrics import metrics
+
+LOG_DROPPED = metrics.counter("log_records_dropped_total", "Structured log records dropped by file")
+
+class LogWriter:
+    """Неблокирующая пакетная запись структурированных логов в JSONL.
+
+    Производители кладут записи в ограниченную очередь и никогда не
+    ждут диска: при переполнении запись отбрасывается и учитывается в
+    счетчике. Фоновый поток пишет записи пачками, ротирует файл по
+    размеру и при необходимости сжимает старые части.
+    """
+    def __init__(
+        self,
+        path: str,
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_interval: float = 0.5,
+        max_bytes: int = 10 * 1024 * 1024,
+        backup_count: int = 5,
+        compress: bool = False,
+        max_field_length: int = 2000
+    ):
+        self.path = Path(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.compress = compress
+        self.max_field_length = max_field_length
+
+        self.enqueued = 0
+        self.written = 0
+        self.rotations = 0
+
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"log-writer:{self.path.name}",
+            daemon=True
+        )
+        self._thread.start()
+
+    def emit(self, record: Dict[str, Any]) -> bool:
+        """Постановка записи в очередь без блокировки"""
+        if self._stopped.is_set():
+            LOG_DROPPED.inc(log=str(self.path))
+            return False
+        try:
+            self._queue.put_nowait(self._truncate(record))
+        except queue.Full:
+            LOG_DROPPED.inc(log=str(self.path))
+            return False
+        self.enqueued += 1
+        return True
+
+    @property
+    def dropped(self) -> int:
+        return int(LOG_DROPPED.value(log=str(self.path)))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'rotations': self.rotations,
+            'queued': self._queue.qsize()
+        }
+
+    def close(self, timeout: float = 5.0):
+        """Остановка потока с дозаписью очереди.
+
+        Файл закрывает сам поток, дописав очередь: если он не успел
+        за ``timeout``, запись продолжается в открытый файл.
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+
+    def _truncate(self, value: Any) -> Any:
+        if isinstance(value, str) and len(value) > self.max_field_length:
+            return value[:self.max_field_length] + f"...[{len(value) - self.max_field_length} chars truncated]"
+        if isinstance(value, dict):
+            return {k: self._truncate(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self._truncate(v) for v in value]
+        return value
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._write_batch(batch)
+        self._file.close()
+
+    def _write_batch(self, batch):
+        lines = "".join(
+            json.dumps(record, ensure_ascii=False, default=str) + "\n"
+            for record in batch
+        )
+        try:
+            self._file.write(lines)
+            self._file.flush()
+            self.written += len(batch)
+            if self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            LOG_DROPPED.inc(len(batch), log=str(self.path))
+
+    def _rotate(self):
+        """Ротация: log.jsonl -> log.jsonl.1[.gz] -> ... -> log.jsonl.N[.gz]"""
+        self._file.close()
+        suffix = ".gz" if self.compress else ""
+        for i in range(self.backup_count - 1, 0, -1):
+            src = Path(f"{self.path}.{i}{suffix}")
+            if src.exists():
+                os.replace(src, f"{self.path}.{i + 1}{suffix}")
+
+        if self.backup_count > 0:
+            if self.compress:
+                with open(self.path, 'rb') as src, gzip.open(f"{self.path}.1.gz", 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                self.path.unlink()
+            else:
+                os.replace(self.path, f"{self.path}.1")
+        else:
+            self.path.unlink()
+
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self.rotations += 1
+
+_writers: Dict[str, LogWriter] = {}
+_writers_lock = threading.Lock()
+
+def get_log_writer(path: str, **kwargs) -> LogWriter:
+    """Общий экземпляр писателя для файла"""
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            kwargs.setdefault('max_bytes', config.LOG_MAX_BYTES)
+            kwargs.setdefault('backup_count', config.LOG_BACKUP_COUNT)
+            kwargs.setdefault('compress', config.LOG_COMPRESS)
+            writer = _writers[path] = LogWriter(path, **kwargs)
+        return writer
+
+@atexit.register
+def close_log_writers():
+    for writer in list(_writers.values()):
+        writer.close()
@@ -1,20 +1,54 @@
 import logging
+import logging.handlers
 import json
+import queue
 from datetime import datetime
+import config
+from .log_writer import LOG_DROPPED, get_log_writer
 
-def setup_logging():
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполнении очереди отбрасывает запись"""
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc(log="app.log")
+
+_listener = None
+
+def setup_logging(max_queue: int = 10000):
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=max_queue)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = [logging.FileHandler('app.log'), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers)
+    _listener.start()
+    # Итоговое форматирование делают обработчики слушателя
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('app.log'),
-            logging.StreamHandler()
-        ]
+        handlers=[queue_handler]
     )
 
 class RequestLogger:
+    # События, которые дублируются в app.log/stderr через QueueHandler
+    SEVERITY = {
+        'SECURITY_BLOCK': logging.WARNING,
+        'PROCESSING_ERROR': logging.WARNING,
+        'INTERNAL_ERROR': logging.ERROR
+    }
+    MAX_MIRRORED_FIELD = 1000
+
     def __init__(self):
         self.logger = logging.getLogger('security')
+        self.writer = get_log_writer(config.EVENT_LOG_PATH)
 
     def log(self, event_type: str, details: dict):
         log_entry = {
@@ -22,4 +56,12 @@ class RequestLogger:
             'type': event_type,
             'details': details
         }
-        self.logger.info(json.dumps(log_entry))
\ No newline at end of file
+        self.writer.emit(log_entry)
+
+        level = self.SEVERITY.get(event_type)
+        if level is not None:
+            mirrored = {
+                key: value[:self.MAX_MIRRORED_FIELD] if isinstance(value, str) else value
+                for key, value in details.items()
+            }
+            self.logger.log(level, json.dumps({**log_entry, 'details': mirrored}, default=str))
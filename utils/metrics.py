@@ -0,0 +1,186 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Optional, Tuple
+
+import config
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+# Метки, добавляемые ко всем сэмплам (например, номер воркера)
+_constant_labels: LabelKey = ()
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(_constant_labels) + list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+class Counter:
+    TYPE = "counter"
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(labels), 0.0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{_format_labels(key)} {_format_value(value)}"
+
+class Gauge(Counter):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def dec(self, value: float = 1.0, **labels):
+        self.inc(-value, **labels)
+
+class Summary:
+    """Распределение значений с квантилями по скользящему окну наблюдений"""
+    TYPE = "summary"
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, name: str, help_text: str, window: int = 2048):
+        self.name = name
+        self.help = help_text
+        self.window = window
+        self._samples: Dict[LabelKey, deque] = {}
+        self._sums: Dict[LabelKey, float] = {}
+        self._counts: Dict[LabelKey, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            window = self._samples.get(key)
+            if window is None:
+                window = self._samples[key] = deque(maxlen=self.window)
+            window.append(value)
+            self._sums[key] = self._sums.get(key, 0.0) + value
+            self._counts[key] = self._counts.get(key, 0) + 1
+
+    def quantile(self, q: float, **labels) -> float:
+        window = self._samples.get(_label_key(labels))
+        if not window:
+            return float("nan")
+        ordered = sorted(window)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    def samples(self) -> Iterable[str]:
+        with self._lock:
+            snapshot = [(key, sorted(window)) for key, window in self._samples.items()]
+        for key, ordered in snapshot:
+            for q in self.QUANTILES:
+                value = ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+                yield f"{self.name}{_format_labels(key, ('quantile', str(q)))} {_format_value(value)}"
+            yield f"{self.name}_sum{_format_labels(key)} {_format_value(self._sums[key])}"
+            yield f"{self.name}_count{_format_labels(key)} {self._counts[key]}"
+
+class MetricsRegistry:
+    """Реестр метрик с экспортом в текстовом формате Prometheus.
+
+    Если метрики выключены, ``span`` возвращает общий nullcontext и
+    не замеряет время.
+    """
+    def __init__(self, enabled: bool = True, prefix: str = "mindforce"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._null_span = nullcontext()
+        self.stage_seconds = self.summary("stage_seconds", "Latency of pipeline stages")
+
+    def _register(self, cls, name: str, help_text: str):
+        full_name = f"{self.prefix}_{name}"
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, help_text)
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        return self._register(Counter, name, help_text)
+
+    def gauge(self, name: str, help_text: str) -> Gauge:
+        return self._register(Gauge, name, help_text)
+
+    def summary(self, name: str, help_text: str) -> Summary:
+        return self._register(Summary, name, help_text)
+
+    def set_constant_labels(self, **labels):
+        """Метки процесса, которые получают все экспортируемые сэмплы"""
+        global _constant_labels
+        _constant_labels = _label_key(labels)
+
+    def span(self, stage: str, **labels):
+        """Замер длительности шага: ``with metrics.span("sanitize"): ...``"""
+        if not self.enabled:
+            return self._null_span
+        return self._timed(stage, labels)
+
+    @contextmanager
+    def _timed(self, stage: str, labels: Dict[str, str]):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - start, stage=stage, **labels)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Атомарная запись метрик в файл (для node_exporter textfile)"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_path, path)
+
+    async def handle_metrics(self, request):
+        from aiohttp import web
+        return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+    async def start_http_server(self, host: str = "127.0.0.1", port: int = 9108):
+        """Локальный endpoint /metrics на aiohttp"""
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        return runner
+
+metrics = MetricsRegistry(enabled=config.METRICS_ENABLED)
@@ -0,0 +1,82 @@
+import hashlib
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+from .cache import SmartCache
+
+class StageTrace:
+    """Трассировка стадий одного запроса: что пересчитано, что взято из памяти"""
+    def __init__(self):
+        self.stages: List[Dict[str, Any]] = []
+        # Причина отказа из-за перегрузки (полная очередь пула агента)
+        self.rejected: Optional[str] = None
+        # Причина блокировки проверкой безопасности
+        self.blocked: Optional[str] = None
+        # Непредвиденная ошибка конвейера
+        self.failed: Optional[str] = None
+
+    def record(self, stage: str, key: str, reused: bool, duration: float):
+        self.stages.append({
+            'stage': stage,
+            'key': key,
+            'status': 'reused' if reused else 'computed',
+            'duration_ms': round(duration * 1000, 3)
+        })
+
+    @property
+    def recomputed(self) -> List[str]:
+        return [s['stage'] for s in self.stages if s['status'] == 'computed']
+
+    @property
+    def reused(self) -> List[str]:
+        return [s['stage'] for s in self.stages if s['status'] == 'reused']
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'stages': self.stages}
+
+class StageMemo:
+    """Контентно-адресуемая мемоизация стадий конвейера.
+
+    Ключ стадии строится из её имени, версии (модель, шаблоны),
+    входных данных и ключей вышестоящих стадий. Изменение версии
+    одной стадии меняет ключи только её и последующих стадий.
+    """
+    def __init__(self, cache: Optional[SmartCache] = None):
+        self.cache = cache or SmartCache(cache_dir="cache/stages")
+
+    @staticmethod
+    def stage_key(
+        stage: str,
+        version: str,
+        inputs: Iterable[str] = (),
+        upstream: Iterable[str] = ()
+    ) -> str:
+        """Генерация ключа стадии"""
+        digest = hashlib.sha256()
+        for part in (stage, version, *inputs, *upstream):
+            encoded = part.encode()
+            digest.update(len(encoded).to_bytes(8, 'little'))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    async def run(
+        self,
+        stage: str,
+        key: str,
+        compute: Callable[[], Awaitable[Any]],
+        trace: StageTrace
+    ) -> Any:
+        """Возврат сохраненного результата стадии или его вычисление"""
+        start = time.perf_counter()
+        cached = self.cache.check_cache(key)
+        if cached is not None:
+            trace.record(stage, key, True, time.perf_counter() - start)
+            return cached
+
+        value = await compute()
+        self.store(stage, key, value, trace, time.perf_counter() - start)
+        return value
+
+    def store(self, stage: str, key: str, value: Any, trace: StageTrace, duration: float):
+        """Сохранение результата, посчитанного до того, как стал известен ключ"""
+        self.cache.save_cache(key, value, {'stage': stage})
+        trace.record(stage, key, False, duration)